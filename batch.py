@@ -0,0 +1,197 @@
+"""Optimize a JSONL corpus of prompt pairs.
+
+Each input line is a PromptPair object (`system_prompt`, `user_prompt`) with an
+optional `id`. Results are appended to the output file as they finish, one
+AnalysisData object per line tagged with the record id. Re-running with the
+same output file skips records that already completed.
+
+    python batch.py prompts.jsonl results.jsonl --concurrency 8
+
+With --judge-batch N, rounds are scored N at a time by score_outputs_batch
+instead of one judge call each.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import weave
+
+from exp import PromptPair, score_outputs_batch
+from metrics import write_metrics
+from tracing import init_tracing
+from utils import AnalysisData, generate_responses
+
+
+def record_id(record: dict) -> str:
+    if record.get("id") is not None:
+        return str(record["id"])
+    # Stable id from the prompt text so resumes work without explicit ids
+    payload = json.dumps(
+        [record.get("system_prompt"), record.get("user_prompt")], sort_keys=True
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+def read_records(path: str) -> Iterator[tuple[str, PromptPair]]:
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield record_id(record), PromptPair.model_validate(record)
+            except ValueError as e:
+                print(f"Skipping line {line_number}: {e}", file=sys.stderr)
+
+
+def completed_ids(path: str) -> set[str]:
+    if not os.path.exists(path):
+        return set()
+    done = set()
+    with open(path) as f:
+        for line in f:
+            try:
+                done.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                # A partially written last line from an interrupted run
+                continue
+    return done
+
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    concurrency: int = 4,
+    candidates: int = 1,
+    judge_batch: int = 1,
+) -> dict:
+    done = completed_ids(output_path)
+    stats = {"completed": 0, "skipped": 0, "failed": 0}
+    batch_judging = judge_batch > 1
+
+    executor = weave.ThreadPoolExecutor(max_workers=concurrency)
+    with open(output_path, "a") as out, executor:
+        running = {}
+        # Finished but not yet scored rounds, when judging in batches
+        unscored: list[tuple[str, AnalysisData]] = []
+
+        def write(rid: str, analysis_data: AnalysisData):
+            out.write(json.dumps({"id": rid, **analysis_data.to_dict()}) + "\n")
+            out.flush()
+            stats["completed"] += 1
+
+        def judge():
+            scores = score_outputs_batch(
+                [
+                    (
+                        PromptPair(
+                            system_prompt=data.original_system_prompt,
+                            user_prompt=data.user_prompt,
+                        ),
+                        data.original_output,
+                        data.optimized_output,
+                    )
+                    for _, data in unscored
+                ]
+            )
+            for (rid, analysis_data), score in zip(unscored, scores):
+                if isinstance(score, Exception):
+                    stats["failed"] += 1
+                    print(f"Record {rid} failed scoring: {score}", file=sys.stderr)
+                    continue
+                write(rid, analysis_data.with_scores(score))
+            unscored.clear()
+
+        def drain():
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                rid = running.pop(future)
+                try:
+                    analysis_data = future.result()
+                except Exception as e:
+                    stats["failed"] += 1
+                    print(f"Record {rid} failed: {e}", file=sys.stderr)
+                    continue
+                if not batch_judging:
+                    write(rid, analysis_data)
+                    continue
+                unscored.append((rid, analysis_data))
+                if len(unscored) >= judge_batch:
+                    judge()
+
+        for rid, prompt_pair in read_records(input_path):
+            if rid in done:
+                stats["skipped"] += 1
+                continue
+            # Stream the input: never hold more than `concurrency` rounds
+            if len(running) >= concurrency:
+                drain()
+            done.add(rid)
+            future = executor.submit(
+                generate_responses,
+                prompt_pair,
+                candidates=candidates,
+                judge=not batch_judging,
+            )
+            running[future] = rid
+
+        while running:
+            drain()
+        if unscored:
+            judge()
+
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("input", help="JSONL file of prompt pairs")
+    parser.add_argument("output", help="JSONL file to append results to")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--candidates",
+        type=int,
+        default=1,
+        help="optimized prompts to generate and judge per record",
+    )
+    parser.add_argument(
+        "--judge-batch",
+        type=int,
+        default=1,
+        help="score this many rounds per batched judge call",
+    )
+    parser.add_argument("--project", help="weave project to trace to")
+    parser.add_argument(
+        "--metrics-file", help="write Prometheus-format op metrics here at the end"
+    )
+    args = parser.parse_args()
+
+    if args.project:
+        init_tracing(args.project)
+    try:
+        stats = run_batch(
+            args.input,
+            args.output,
+            args.concurrency,
+            args.candidates,
+            args.judge_batch,
+        )
+    except KeyboardInterrupt:
+        print("\nInterrupted. Re-run the same command to resume.")
+        return
+    finally:
+        if args.metrics_file:
+            write_metrics(args.metrics_file)
+    print(
+        f"Completed {stats['completed']}, skipped {stats['skipped']} "
+        f"already done, failed {stats['failed']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+"""End-to-end latency benchmark for generate_responses.
+
+Runs rounds against the local mock server (or --base-url) at each concurrency
+level and reports p50/p95/p99 round latency and throughput. The response
+cache and rate limits are disabled so every round does the full work.
+
+    python bench.py --rounds 40 --concurrency 1 4 16 --latency 0.2
+    python bench.py --routing single static size --model-latency gpt-4o-mini=0.05
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import time
+from typing import Optional
+
+# Benchmarks never trace; set before the app modules read it
+os.environ.setdefault("PROMPTER_TRACING", "off")
+
+import weave
+from pydantic import BaseModel
+
+import exp
+from exp import DEFAULT_SYSTEM_PROMPT, DEFAULT_USER_PROMPT, PromptPair
+from mock_server import MockLLMServer
+from routing import POLICIES
+from scheduler import Scheduler
+from sizing import count_tokens
+from utils import AnalysisData, generate_responses
+
+
+class BenchResult(BaseModel):
+    name: str
+    concurrency: int
+    rounds: int
+    errors: int
+    wall_time: float
+    throughput: float  # rounds per second
+    p50: float
+    p95: float
+    p99: float
+    mean: float
+    # Averages over rounds that returned an AnalysisData
+    tokens_per_round: Optional[float] = None
+    score_delta: Optional[float] = None  # optimized minus original judge score
+    # Mean seconds per pipeline stage
+    stage_latency: dict[str, float] = {}
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(
+    name: str,
+    concurrency: int,
+    latencies: list[float],
+    errors: int,
+    wall_time: float,
+    outputs: list = (),
+) -> BenchResult:
+    rounds = [o for o in outputs if isinstance(o, AnalysisData)]
+    tokens = [o.usage.total for o in rounds if o.usage]
+    scored = [o for o in rounds if o.original_score is not None]
+    stages: dict[str, list[float]] = {}
+    for o in rounds:
+        for stage, timing in (o.timings.stages if o.timings else {}).items():
+            stages.setdefault(stage, []).append(timing.duration)
+    return BenchResult(
+        name=name,
+        concurrency=concurrency,
+        rounds=len(latencies),
+        errors=errors,
+        wall_time=wall_time,
+        throughput=len(latencies) / wall_time if wall_time else 0.0,
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95),
+        p99=percentile(latencies, 99),
+        mean=sum(latencies) / len(latencies),
+        tokens_per_round=sum(t.prompt_tokens + t.completion_tokens for t in tokens)
+        / len(tokens)
+        if tokens
+        else None,
+        score_delta=sum(o.optimized_score - o.original_score for o in scored)
+        / len(scored)
+        if scored
+        else None,
+        stage_latency={
+            stage: sum(durations) / len(durations)
+            for stage, durations in stages.items()
+        },
+    )
+
+
+def bench_rounds(
+    name: str, round_fn, rounds: int, concurrency: int
+) -> Optional[BenchResult]:
+    """Time `rounds` calls of `round_fn(i)` with `concurrency` in flight."""
+    latencies = []
+    outputs = []
+    errors = 0
+
+    def timed(i: int) -> tuple[float, object]:
+        started = time.perf_counter()
+        output = round_fn(i)
+        return time.perf_counter() - started, output
+
+    started = time.perf_counter()
+    with weave.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(timed, i) for i in range(rounds)]
+        for future in futures:
+            try:
+                latency, output = future.result()
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(latency)
+            outputs.append(output)
+    wall_time = time.perf_counter() - started
+    if not latencies:
+        return None
+    return summarize(name, concurrency, latencies, errors, wall_time, outputs)
+
+
+def long_prompt(tokens: int) -> str:
+    """A system prompt of about `tokens` tokens, one numbered rule per line"""
+    lines = []
+    while count_tokens("\n".join(lines)) < tokens:
+        lines.append(f"Rule {len(lines) + 1}: {DEFAULT_SYSTEM_PROMPT}")
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def exp_settings(**settings):
+    """Override exp module settings for one variant"""
+    saved = {name: getattr(exp, name) for name in settings}
+    for name, value in settings.items():
+        setattr(exp, name, value)
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            setattr(exp, name, value)
+
+
+def print_results(results: list[BenchResult]):
+    print(
+        f"{'benchmark':<24} {'conc':>4} {'rounds':>6} {'err':>4} "
+        f"{'p50':>7} {'p95':>7} {'p99':>7} {'rounds/s':>9} "
+        f"{'tokens':>8} {'delta':>6}"
+    )
+    for r in results:
+        tokens = f"{r.tokens_per_round:.0f}" if r.tokens_per_round is not None else "-"
+        delta = f"{r.score_delta:+.1f}" if r.score_delta is not None else "-"
+        print(
+            f"{r.name:<24} {r.concurrency:>4} {r.rounds:>6} {r.errors:>4} "
+            f"{r.p50:>7.3f} {r.p95:>7.3f} {r.p99:>7.3f} {r.throughput:>9.2f} "
+            f"{tokens:>8} {delta:>6}"
+        )
+
+    stages = list(dict.fromkeys(s for r in results for s in r.stage_latency))
+    if not stages:
+        return
+    print(
+        f"\n{'mean stage seconds':<24} {'conc':>4} "
+        + " ".join(f"{s:>16}" for s in stages)
+    )
+    for r in results:
+        print(
+            f"{r.name:<24} {r.concurrency:>4} "
+            + " ".join(
+                f"{r.stage_latency[s]:>16.3f}" if s in r.stage_latency else f"{'-':>16}"
+                for s in stages
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--latency", type=float, default=0.1)
+    parser.add_argument("--jitter", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--defect-rate",
+        type=float,
+        default=0.0,
+        help="fraction of mock JSON responses with a repairable defect",
+    )
+    parser.add_argument(
+        "--token-delay", type=float, default=0.0, help="mock seconds per word"
+    )
+    parser.add_argument(
+        "--compare-fused",
+        action="store_true",
+        help="also run rounds with the fused analyze+optimize stage",
+    )
+    parser.add_argument(
+        "--prompt-delay", type=float, default=0.0, help="mock seconds per prompt token"
+    )
+    parser.add_argument(
+        "--long-prompt-tokens",
+        type=int,
+        help="also run rounds on a system prompt this long, chunked and unchunked",
+    )
+    parser.add_argument(
+        "--routing",
+        nargs="+",
+        choices=sorted(POLICIES),
+        help="also run rounds under each of these model routing policies",
+    )
+    parser.add_argument(
+        "--model-latency",
+        nargs="+",
+        default=[],
+        metavar="MODEL=SECONDS",
+        help="mock latency for specific models, overriding --latency",
+    )
+    parser.add_argument("--base-url", help="benchmark this endpoint instead")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    server = None
+    if args.base_url:
+        exp.configure_client(base_url=args.base_url)
+    else:
+        server = MockLLMServer(
+            latency=args.latency,
+            jitter=args.jitter,
+            token_delay=args.token_delay,
+            error_rate=args.error_rate,
+            defect_rate=args.defect_rate,
+            prompt_delay=args.prompt_delay,
+            model_latency={
+                model: float(seconds)
+                for model, seconds in (m.split("=", 1) for m in args.model_latency)
+            },
+        ).start()
+        exp.configure_client(base_url=server.base_url, api_key="mock")
+    # Every round pays for its own calls: no cached or coalesced responses
+    exp.response_cache.enabled = False
+    exp.in_flight.enabled = False
+    exp.scheduler = Scheduler(
+        requests_per_minute=1e9, tokens_per_minute=1e12, base_delay=0.05
+    )
+
+    prompt_pair = PromptPair(
+        system_prompt=DEFAULT_SYSTEM_PROMPT, user_prompt=DEFAULT_USER_PROMPT
+    )
+    variants = {"generate_responses": lambda i: generate_responses(prompt_pair)}
+    if args.compare_fused:
+        variants["fused"] = lambda i: generate_responses(prompt_pair, fused=True)
+    # exp settings to apply while a variant runs
+    settings = {}
+    if args.long_prompt_tokens:
+        long_pair = PromptPair(
+            system_prompt=long_prompt(args.long_prompt_tokens),
+            user_prompt=DEFAULT_USER_PROMPT,
+        )
+        variants["long_prompt"] = lambda i: generate_responses(long_pair)
+        variants["long_prompt_unchunked"] = lambda i: generate_responses(long_pair)
+        settings["long_prompt_unchunked"] = {
+            "MAX_ANALYSIS_TOKENS": 10**9,
+            "MAX_JUDGED_OUTPUT_TOKENS": 10**9,
+        }
+    for policy in args.routing or []:
+        name = f"routing={policy}"
+        variants[name] = lambda i: generate_responses(prompt_pair)
+        settings[name] = {"routing": POLICIES[policy]}
+
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            for name, round_fn in variants.items():
+                with exp_settings(**settings.get(name, {})):
+                    result = bench_rounds(name, round_fn, args.rounds, concurrency)
+                if result:
+                    results.append(result)
+    finally:
+        if server:
+            server.stop()
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([r.model_dump() for r in results], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Cold-start import benchmark for the app modules.
+
+Runs `python -X importtime -c "import <module>"` in a fresh interpreter for
+each module and reports its cumulative import time and the slowest imports
+under it. Save a baseline with --save and check later runs with --compare.
+
+    python bench_import.py --save import_baseline.json
+    python bench_import.py --compare import_baseline.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+MODULES = ["exp", "utils", "game"]
+
+
+def import_times(module: str) -> dict[str, int]:
+    """Cumulative import time in microseconds for every module imported."""
+    env = {**os.environ, "PROMPTER_TRACING": "off"}
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=False,
+        env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def run(repeat: int, top: int) -> dict[str, int]:
+    totals = {}
+    for module in MODULES:
+        # Best of `repeat` runs to smooth out disk cache noise
+        runs = [import_times(module) for _ in range(repeat)]
+        best = min(runs, key=lambda times: times[module])
+        totals[module] = best[module]
+        print(f"{module}: {best[module] / 1000:.1f} ms")
+        slowest = sorted(
+            (item for item in best.items() if item[0] != module),
+            key=lambda item: item[1],
+            reverse=True,
+        )
+        for name, cumulative in slowest[:top]:
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=8)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed slowdown vs the baseline before failing (0.2 = 20%%)",
+    )
+    args = parser.parse_args()
+
+    totals = run(args.repeat, args.top)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(totals, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressed = False
+        print("\nvs baseline:")
+        for module, micros in totals.items():
+            if module not in baseline:
+                continue
+            change = micros / baseline[module] - 1
+            flag = "  REGRESSION" if change > args.tolerance else ""
+            regressed = regressed or bool(flag)
+            print(f"{module}: {change:+.0%}{flag}")
+        sys.exit(1 if regressed else 0)
+
+
+if __name__ == "__main__":
+    main()
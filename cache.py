@@ -0,0 +1,223 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Optional, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+class CacheStats(BaseModel):
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+    memory_entries: int = 0
+    disk_entries: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+
+class ResponseCache:
+    """Two-tier cache for LLM responses: an in-memory LRU in front of SQLite.
+
+    Entries expire `ttl` seconds after they were written. The memory tier holds
+    at most `max_memory_entries` and the disk tier `max_disk_entries`, evicting
+    the least recently used first. Pass `path=None` for a memory-only cache.
+    Setting `enabled = False` turns every lookup into an uncounted miss.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = ".prompter_cache.sqlite",
+        max_memory_entries: int = 256,
+        max_disk_entries: int = 10_000,
+        ttl: float = 7 * 24 * 3600,
+    ):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.enabled = True
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._stats = CacheStats()
+
+    @staticmethod
+    def make_key(
+        model: str,
+        messages: list[dict],
+        response_format: Optional[dict] = None,
+        params: Optional[dict] = None,
+    ) -> str:
+        request = {
+            "model": model,
+            "messages": messages,
+            "response_format": response_format,
+        }
+        if params:
+            # Sampling parameters such as temperature
+            request["params"] = params
+        payload = json.dumps(request, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        # Opened lazily so importing the module never touches the disk
+        if self._db is None and self.path:
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at "
+                "ON responses (accessed_at)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _remember(self, key: str, created_at: float, value: str):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self._stats.evictions += 1
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and now - entry[0] < self.ttl:
+                self._memory.move_to_end(key)
+                self._stats.memory_hits += 1
+                return entry[1]
+            self._memory.pop(key, None)
+
+            db = self._connect()
+            if db is not None:
+                row = db.execute(
+                    "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row and now - row[1] < self.ttl:
+                    db.execute(
+                        "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                        (now, key),
+                    )
+                    db.commit()
+                    self._remember(key, row[1], row[0])
+                    self._stats.disk_hits += 1
+                    return row[0]
+
+            self._stats.misses += 1
+            return None
+
+    def set(self, key: str, value: str):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            self._stats.writes += 1
+
+            db = self._connect()
+            if db is None:
+                return
+            db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            evicted = db.execute(
+                "DELETE FROM responses WHERE created_at < ? OR key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at DESC "
+                "LIMIT -1 OFFSET ?)",
+                (now - self.ttl, self.max_disk_entries),
+            ).rowcount
+            db.commit()
+            self._stats.evictions += evicted
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            db = self._connect()
+            if db is not None:
+                db.execute("DELETE FROM responses")
+                db.commit()
+
+    def stats(self) -> CacheStats:
+        with self._lock:
+            stats = self._stats.model_copy()
+            stats.memory_entries = len(self._memory)
+            db = self._connect()
+            if db is not None:
+                stats.disk_entries = db.execute(
+                    "SELECT COUNT(*) FROM responses"
+                ).fetchone()[0]
+            return stats
+
+
+class SingleFlightStats(BaseModel):
+    # Calls that did the work
+    leaders: int = 0
+    # Calls that waited on an identical call already in flight
+    coalesced: int = 0
+    in_flight: int = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller for a key runs `fn`; callers arriving while it is running
+    wait for and share its result, or its exception. Setting `enabled = False`
+    runs every call on its own, uncounted.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._calls: dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._stats = SingleFlightStats()
+
+    def do(self, key: str, fn: Callable[[], T]) -> tuple[T, bool]:
+        """Returns fn's result and whether it was shared from another caller."""
+        if not self.enabled:
+            return fn(), False
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+                self._stats.leaders += 1
+            else:
+                self._stats.coalesced += 1
+        if not leader:
+            return future.result(), True
+
+        try:
+            result = fn()
+            future.set_result(result)
+            return result, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self) -> SingleFlightStats:
+        with self._lock:
+            stats = self._stats.model_copy()
+            stats.in_flight = len(self._calls)
+            return stats
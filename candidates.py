@@ -0,0 +1,90 @@
+from typing import Optional
+
+import weave
+from pydantic import BaseModel
+
+from exp import (
+    OptimizedPrompt,
+    OutputRanking,
+    PromptAnalysis,
+    PromptPair,
+    generate_output,
+    optimize_prompt,
+    rank_outputs,
+)
+
+
+class Candidate(BaseModel):
+    optimized: OptimizedPrompt
+    output: str
+    temperature: float
+    focus: Optional[str] = None
+    score: Optional[int] = None
+
+
+class TournamentResult(BaseModel):
+    candidates: list[Candidate]
+    ranking: OutputRanking
+
+    @property
+    def winner(self) -> Candidate:
+        return self.candidates[self.ranking.winner - 1]
+
+
+def candidate_settings(
+    analysis: PromptAnalysis, n: int
+) -> list[tuple[float, Optional[str]]]:
+    """(temperature, focus) for each of `n` candidates.
+
+    Temperatures spread from 0.3 to 1.0 and each candidate focuses on a
+    different improvement idea from the analysis, so the candidates differ.
+    """
+    ideas = analysis.program_improvement_ideas
+    return [
+        (
+            round(0.3 + 0.7 * i / max(1, n - 1), 2),
+            ideas[i % len(ideas)] if ideas else None,
+        )
+        for i in range(n)
+    ]
+
+
+@weave.op
+def optimize_candidates(
+    prompt_pair: PromptPair,
+    analysis: PromptAnalysis,
+    prompt: str,
+    n: int = 3,
+    max_concurrency: int = 4,
+) -> TournamentResult:
+    """Optimize `prompt` `n` ways in parallel and keep the best.
+
+    Each candidate's optimized prompt and output are generated concurrently,
+    with at most `max_concurrency` candidates in flight, then all outputs are
+    judged together in a single rank_outputs call.
+    """
+    if n < 2:
+        raise ValueError("A tournament needs at least 2 candidates")
+
+    def run_candidate(temperature: float, focus: Optional[str]) -> Candidate:
+        optimized = optimize_prompt(
+            analysis, prompt, temperature=temperature, focus=focus
+        )
+        return Candidate(
+            optimized=optimized,
+            output=generate_output(prompt_pair.user_prompt, optimized.optimized_prompt),
+            temperature=temperature,
+            focus=focus,
+        )
+
+    with weave.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = [
+            executor.submit(run_candidate, temperature, focus)
+            for temperature, focus in candidate_settings(analysis, n)
+        ]
+        candidates = [future.result() for future in futures]
+
+    ranking = rank_outputs(prompt_pair, [c.output for c in candidates])
+    for candidate, score in zip(candidates, ranking.scores):
+        candidate.score = score
+    return TournamentResult(candidates=candidates, ranking=ranking)
@@ -0,0 +1,237 @@
+import atexit
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from typing import Optional
+
+from pydantic import BaseModel
+
+from utils import AnalysisData
+
+
+class PlayerEval(BaseModel):
+    round_id: str
+    analysis_data: AnalysisData
+    # The player's 1-10 slider ratings
+    player_original: int
+    player_optimized: int
+    created_at: float = 0.0
+
+
+class ProgramStats(BaseModel):
+    program_key: str
+    rounds: int
+    # Fraction of rounds where the player preferred the optimized output
+    player_optimized_win_rate: float
+    # Fraction of rounds where the judge scored the optimized output higher
+    judge_optimized_win_rate: float
+    # Mean optimized minus original score, on the player's 1-10 scale
+    mean_player_delta: float
+    # Mean optimized minus original score, on the judge's 1-100 scale
+    mean_judge_delta: float
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rounds (
+    round_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    program_key TEXT NOT NULL,
+    judge_original INTEGER,
+    judge_optimized INTEGER,
+    player_original INTEGER NOT NULL,
+    player_optimized INTEGER NOT NULL,
+    analysis TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rounds_program_key ON rounds (program_key);
+CREATE INDEX IF NOT EXISTS rounds_created_at ON rounds (created_at);
+CREATE TABLE IF NOT EXISTS program_totals (
+    program_key TEXT PRIMARY KEY,
+    rounds INTEGER NOT NULL,
+    player_optimized_wins INTEGER NOT NULL,
+    judge_optimized_wins INTEGER NOT NULL,
+    judged_rounds INTEGER NOT NULL,
+    player_delta_sum REAL NOT NULL,
+    judge_delta_sum REAL NOT NULL
+);
+"""
+
+
+class EvalStore:
+    """Append-only SQLite store of player evaluations.
+
+    record() only enqueues; a background thread writes in batches of up to
+    `batch_size` every `flush_interval` seconds. Per-program_key totals are
+    updated in the same transaction as the rows they summarize, so
+    leaderboard() reads a handful of precomputed rows instead of scanning
+    rounds. Recording the same round_id twice is a no-op. A batch that still
+    fails after `write_attempts` tries is dropped and reported on stderr.
+    """
+
+    def __init__(
+        self,
+        path: str = ".prompter_evals.sqlite",
+        batch_size: int = 100,
+        flush_interval: float = 1.0,
+        write_attempts: int = 3,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.write_attempts = write_attempts
+        self._pending: queue.Queue = queue.Queue()
+        self._read_lock = threading.Lock()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+        self._reader = self._connect()
+        self._writer = threading.Thread(
+            target=self._write_loop, name="eval-writer", daemon=True
+        )
+        self._writer.start()
+        atexit.register(self.flush)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        # WAL lets the leaderboard read while the writer commits
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def record(self, evaluation: PlayerEval):
+        if not evaluation.created_at:
+            evaluation = evaluation.model_copy(update={"created_at": time.time()})
+        self._pending.put(evaluation)
+
+    def flush(self, timeout: Optional[float] = 10.0) -> bool:
+        """Wait until everything recorded so far is written, or dropped.
+
+        Returns False if `timeout` seconds passed first.
+        """
+        with self._pending.all_tasks_done:
+            return self._pending.all_tasks_done.wait_for(
+                lambda: not self._pending.unfinished_tasks, timeout
+            )
+
+    def _write_loop(self):
+        db = self._connect()
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(
+                        self._pending.get(timeout=max(0, deadline - time.monotonic()))
+                    )
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(db, batch)
+            finally:
+                for _ in batch:
+                    self._pending.task_done()
+
+    def _write_batch(self, db: sqlite3.Connection, batch: list[PlayerEval]):
+        for attempt in range(self.write_attempts):
+            try:
+                with db:
+                    for evaluation in batch:
+                        self._write(db, evaluation)
+                return
+            except sqlite3.OperationalError as e:
+                # e.g. the database is locked or the disk is full
+                error = e
+                time.sleep(0.1 * 2**attempt)
+            except Exception as e:
+                # Retrying won't fix a bad row or a broken schema
+                error = e
+                break
+        print(
+            f"Dropped {len(batch)} player evaluations: {error}",
+            file=sys.stderr,
+        )
+
+    @staticmethod
+    def _write(db: sqlite3.Connection, evaluation: PlayerEval):
+        data = evaluation.analysis_data
+        inserted = db.execute(
+            "INSERT OR IGNORE INTO rounds VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                evaluation.round_id,
+                evaluation.created_at,
+                data.program_key,
+                data.original_score,
+                data.optimized_score,
+                evaluation.player_original,
+                evaluation.player_optimized,
+                data.model_dump_json(),
+            ),
+        ).rowcount
+        if not inserted:
+            return
+
+        judged = data.original_score is not None and data.optimized_score is not None
+        db.execute(
+            "INSERT INTO program_totals VALUES (?, 1, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (program_key) DO UPDATE SET "
+            "rounds = rounds + 1, "
+            "player_optimized_wins = player_optimized_wins + excluded.player_optimized_wins, "
+            "judge_optimized_wins = judge_optimized_wins + excluded.judge_optimized_wins, "
+            "judged_rounds = judged_rounds + excluded.judged_rounds, "
+            "player_delta_sum = player_delta_sum + excluded.player_delta_sum, "
+            "judge_delta_sum = judge_delta_sum + excluded.judge_delta_sum",
+            (
+                data.program_key,
+                int(evaluation.player_optimized > evaluation.player_original),
+                int(judged and data.optimized_score > data.original_score),
+                int(judged),
+                evaluation.player_optimized - evaluation.player_original,
+                data.optimized_score - data.original_score if judged else 0,
+            ),
+        )
+
+    @staticmethod
+    def _stats(program_key: str, row: tuple) -> ProgramStats:
+        rounds, player_wins, judge_wins, judged, player_delta, judge_delta = row
+        return ProgramStats(
+            program_key=program_key,
+            rounds=rounds,
+            player_optimized_win_rate=player_wins / rounds if rounds else 0.0,
+            judge_optimized_win_rate=judge_wins / judged if judged else 0.0,
+            mean_player_delta=player_delta / rounds if rounds else 0.0,
+            mean_judge_delta=judge_delta / judged if judged else 0.0,
+        )
+
+    def leaderboard(self, limit: Optional[int] = None) -> list[ProgramStats]:
+        """Per-program_key aggregates, most played first."""
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT program_key, rounds, player_optimized_wins, "
+                "judge_optimized_wins, judged_rounds, player_delta_sum, "
+                "judge_delta_sum FROM program_totals ORDER BY rounds DESC "
+                "LIMIT ?",
+                (-1 if limit is None else limit,),
+            ).fetchall()
+        return [self._stats(row[0], row[1:]) for row in rows]
+
+    def overall(self) -> ProgramStats:
+        """Aggregates across every program_key."""
+        with self._read_lock:
+            row = self._reader.execute(
+                "SELECT COALESCE(SUM(rounds), 0), "
+                "COALESCE(SUM(player_optimized_wins), 0), "
+                "COALESCE(SUM(judge_optimized_wins), 0), "
+                "COALESCE(SUM(judged_rounds), 0), "
+                "COALESCE(SUM(player_delta_sum), 0), "
+                "COALESCE(SUM(judge_delta_sum), 0) FROM program_totals"
+            ).fetchone()
+        return self._stats("all", row)
+
+    def rounds_since(self, since: float, program_key: Optional[str] = None) -> int:
+        """Rounds recorded since a timestamp, optionally for one program_key."""
+        query = "SELECT COUNT(*) FROM rounds WHERE created_at >= ?"
+        params: tuple = (since,)
+        if program_key is not None:
+            query += " AND program_key = ?"
+            params += (program_key,)
+        with self._read_lock:
+            return self._reader.execute(query, params).fetchone()[0]
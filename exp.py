@@ -1,8 +1,26 @@
-from typing import Optional
-from pydantic import BaseModel
-from openai import OpenAI
-
+import collections
+import difflib
+import os
+import queue
+import textwrap
+import threading
+import time
+from collections.abc import Iterator
+from typing import Annotated, Callable, Optional, TypeVar, Union
+
+import httpx
+import openai
 import weave
+from openai import DefaultHttpxClient, OpenAI
+from pydantic import BaseModel, Field
+
+import structured
+from cache import ResponseCache, SingleFlight
+from metrics import CallMetrics, current_op, instrumented, record_call, registry
+from routing import POLICIES
+from scheduler import RETRYABLE_ERRORS, CallTiming, Scheduler, estimate_tokens
+from sizing import count_tokens, split_text, truncate
+from tracing import init_tracing
 
 DEFAULT_USER_PROMPT = """I'm going to the store to buy some eggs.
 too bad inflation is so high.
@@ -12,7 +30,270 @@ small omelettes for breakfast I guess
 """
 DEFAULT_SYSTEM_PROMPT = "Rewrite this poem in Shakespeare's style."
 
-MODEL = "gpt-4o"
+
+class ClientConfig(BaseModel):
+    # None falls back to the OPENAI_BASE_URL / OPENAI_API_KEY env vars
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    timeout: float = 60.0
+    # Retries are handled by the shared scheduler so they respect rate limits
+    max_retries: int = 0
+
+
+_client: Optional[OpenAI] = None
+_client_config = ClientConfig()
+_client_lock = threading.Lock()
+
+
+def configure_client(**options) -> ClientConfig:
+    """Update the shared client settings.
+
+    Accepts any ClientConfig field, e.g. `configure_client(base_url=...)` to
+    point every op at a local fake server. The client is rebuilt lazily on the
+    next get_client() call.
+    """
+    global _client, _client_config
+    with _client_lock:
+        _client_config = _client_config.model_copy(update=options)
+        _client = None
+    return _client_config
+
+
+def get_client() -> OpenAI:
+    """Return the process-wide OpenAI client, creating it on first use.
+
+    Sharing one client keeps a single keep-alive connection pool across all
+    ops and threads instead of paying a cold connection per request.
+    """
+    global _client
+    client = _client
+    if client is not None:
+        return client
+    with _client_lock:
+        if _client is None:
+            config = _client_config
+            _client = OpenAI(
+                base_url=config.base_url,
+                api_key=config.api_key,
+                timeout=config.timeout,
+                max_retries=config.max_retries,
+                http_client=DefaultHttpxClient(
+                    limits=httpx.Limits(
+                        max_connections=config.max_connections,
+                        max_keepalive_connections=config.max_keepalive_connections,
+                    ),
+                    timeout=config.timeout,
+                ),
+            )
+        return _client
+
+
+# Requests made for a structured response that fails validation even after
+# local repair
+PARSE_ATTEMPTS = 2
+
+# Analyze/optimize/score are pure functions of (model, messages, format), so
+# their responses are shared across players and restarts.
+response_cache = ResponseCache(
+    path=os.environ.get("PROMPTER_CACHE_PATH", ".prompter_cache.sqlite") or None
+)
+
+# Identical cacheable calls already in flight, e.g. many players analyzing the
+# default prompt at once, share a single request
+in_flight = SingleFlight()
+
+# Every LLM call is admitted and retried through this scheduler
+scheduler = Scheduler(
+    requests_per_minute=float(os.environ.get("PROMPTER_RPM", "500")),
+    tokens_per_minute=float(os.environ.get("PROMPTER_TPM", "30000")),
+    max_in_flight=int(os.environ.get("PROMPTER_MAX_IN_FLIGHT", "64")),
+)
+
+# Prompts longer than this are analyzed as chunks in parallel
+MAX_ANALYSIS_TOKENS = int(os.environ.get("PROMPTER_MAX_ANALYSIS_TOKENS", "4000"))
+# Each output is cut to this many tokens before it is judged
+MAX_JUDGED_OUTPUT_TOKENS = int(os.environ.get("PROMPTER_MAX_JUDGED_TOKENS", "2000"))
+# Batched judge requests hold at most this many prompt tokens and comparisons;
+# the item cap keeps the response well under the completion limit
+JUDGE_BATCH_TOKENS = int(os.environ.get("PROMPTER_JUDGE_BATCH_TOKENS", "16000"))
+JUDGE_BATCH_MAX_ITEMS = int(os.environ.get("PROMPTER_JUDGE_BATCH_ITEMS", "20"))
+
+# Picks the model for each op; see routing.POLICIES
+routing = POLICIES[os.environ.get("PROMPTER_ROUTING", "single")]
+# The model for ops the policy doesn't route elsewhere; kept for code that
+# reads exp.MODEL
+MODEL = routing.default.model
+
+# A request still running after this quantile of its op's past request
+# latency gets a duplicate, and the first response wins. 0 disables hedging.
+HEDGE_QUANTILE = float(os.environ.get("PROMPTER_HEDGE_QUANTILE", "0.95"))
+
+T = TypeVar("T")
+
+
+def _call_metrics(
+    usage,
+    timing: CallTiming,
+    fallback: bool = False,
+    hedged: bool = False,
+    invalid: bool = False,
+    repaired: bool = False,
+) -> CallMetrics:
+    return CallMetrics(
+        prompt_tokens=usage.prompt_tokens if usage else 0,
+        completion_tokens=usage.completion_tokens if usage else 0,
+        queued=timing.queued,
+        retries=timing.attempts - 1,
+        fallback=fallback,
+        hedged=hedged,
+        invalid=invalid,
+        repaired=repaired,
+    )
+
+
+def _route(messages: list[dict]) -> list[tuple[str, Optional[float]]]:
+    """(model, timeout) attempts for these messages in the current op"""
+    prompt_tokens = sum(count_tokens(m["content"]) for m in messages)
+    return routing.route(current_op()).attempts(prompt_tokens)
+
+
+def _routed_create(
+    attempts: list[tuple[str, Optional[float]]],
+    messages: list[dict],
+    count_tokens: Callable = lambda response: None,
+    hold_slot: bool = False,
+    **kwargs,
+) -> tuple[object, CallTiming, bool, bool]:
+    """Create a completion on the first model of `attempts`, moving on to the
+    next when it times out or keeps failing.
+
+    Requests slower than the op's usual latency are hedged, except streams.
+    With `hold_slot` the caller must call scheduler.release() once it is done
+    with the response. Returns the response, its scheduler timing, whether a
+    fallback served it and whether it was hedged.
+    """
+    op = current_op()
+    stream = kwargs.get("stream", False)
+    hedge_after = (
+        registry.request_quantile(op, HEDGE_QUANTILE)
+        if op and HEDGE_QUANTILE and not stream
+        else None
+    )
+    estimated_tokens = estimate_tokens(messages)
+    for i, (model, timeout) in enumerate(attempts):
+        last = i == len(attempts) - 1
+        request = dict(kwargs, model=model, messages=messages)
+        if timeout is not None:
+            request["timeout"] = timeout
+        try:
+            response, timing = scheduler.run(
+                lambda request=request: get_client().chat.completions.create(**request),
+                estimated_tokens=estimated_tokens,
+                count_tokens=count_tokens,
+                # A timeout goes straight to the fallback instead of retrying
+                no_retry=() if last else (openai.APITimeoutError,),
+                hedge_after=hedge_after,
+                hold_slot=hold_slot,
+            )
+        except RETRYABLE_ERRORS:
+            if last:
+                raise
+            continue
+        if op and not stream:
+            registry.observe_request(op, timing.in_flight)
+        return response, timing, i > 0, timing.hedged
+
+
+def _chat_completion(
+    messages: list[dict],
+    parse: Optional[Callable[[str], T]] = None,
+    schema: Optional[type[BaseModel]] = None,
+    use_cache: bool = False,
+    **params,
+) -> T:
+    """Run one chat completion and parse its content.
+
+    With `schema`, the response is requested as JSON matching that pydantic
+    model and parsed with it unless `parse` is given. A response that fails
+    to parse is repaired locally, and only requested again if that fails
+    too. Without `schema` the content is returned as text.
+
+    `params` are extra request parameters such as temperature. With
+    `use_cache`, a previously parsed response for the same model, messages,
+    response format and params is reused, and identical calls made while one
+    is in flight wait for it instead of sending their own request. Only
+    responses that parse are cached.
+    """
+    if parse is None:
+        parse = schema.model_validate_json if schema else str
+    response_format = structured.response_format(schema) if schema else None
+    attempts = _route(messages)
+    key = ResponseCache.make_key(attempts[0][0], messages, response_format, params)
+    if use_cache:
+        content = response_cache.get(key)
+        if content is not None:
+            record_call(CallMetrics(cache_hit=True))
+            return parse(content)
+
+    kwargs = dict(params)
+    if response_format:
+        kwargs["response_format"] = response_format
+
+    def request() -> str:
+        for attempt in range(1, PARSE_ATTEMPTS + 1):
+            response, timing, fallback, hedged = _routed_create(
+                attempts,
+                messages,
+                count_tokens=lambda response: (
+                    response.usage and response.usage.total_tokens
+                ),
+                **kwargs,
+            )
+            content = response.choices[0].message.content
+            error: Optional[ValueError] = None
+            repaired = False
+            try:
+                if content is None:
+                    # A refusal; there's nothing to repair
+                    raise ValueError("Response has no content")
+                parse(content)
+            except ValueError as e:
+                error = e
+                if schema is not None and content is not None:
+                    try:
+                        fixed = structured.repair(schema, content)
+                        parse(fixed)
+                        content, repaired = fixed, True
+                    except ValueError:
+                        pass
+            record_call(
+                _call_metrics(
+                    response.usage,
+                    timing,
+                    fallback,
+                    hedged,
+                    invalid=error is not None,
+                    repaired=repaired,
+                )
+            )
+            if error is None or repaired:
+                break
+            if attempt == PARSE_ATTEMPTS:
+                raise error
+        # Fallback responses aren't cached, so the preferred model gets
+        # another chance next time
+        if use_cache and not fallback:
+            response_cache.set(key, content)
+        return content
+
+    if not use_cache:
+        return parse(request())
+    content, shared = in_flight.do(key, request)
+    if shared:
+        record_call(CallMetrics(coalesced=True))
+    return parse(content)
 
 
 class PromptPair(BaseModel):
@@ -20,6 +301,20 @@ class PromptPair(BaseModel):
     user_prompt: str
 
 
+# How to analyze a prompt, shared by the analysis and fused analyze+optimize ops
+ANALYSIS_GUIDE = (
+    "LLMs can be viewed as continuous, interpolative databases that store both data and vector-based programs. "
+    "Unlike traditional databases, data is stored as points in a vector space, enabling interpolation between concepts. "
+    "Prompts act as search queries in this space. Use this information to analyze the prompt, to provide information "
+    "so that we can generate a better prompt. Include: \n"
+    "- **Program Key**: Identifies the instruction that points to a specific behavior in program space.\n"
+    "- **Program Inputs**: The data or context the program will act on.\n"
+    "- **Risk of Hallucination**: Assessment of where interpolation may cause errors or unexpected outputs.\n"
+    "- **Hallucination Targets**: Specific text targets that are at risk of hallucination.\n"
+    "- **Program improvement ideas**: Ideas for improving the prompt.\n"
+)
+
+
 class PromptAnalysis(BaseModel):
     program_key: str
     program_inputs: list[str]
@@ -29,39 +324,138 @@ class PromptAnalysis(BaseModel):
     reasoning: Optional[str] = None
 
 
+# PromptAnalysis fields as described to the model
+ANALYSIS_FIELDS = (
+    "- program_key: A concise identifier for the type of operation.\n"
+    "- program_inputs: List of identified inputs in the prompt.\n"
+    "- hallucination_risk: Assessment of hallucination risk with specific text targets.\n"
+    "- hallucination_targets: List of hallucination targets in the text.\n"
+    "- program_improvement_ideas: Ideas for improving the prompt.\n"
+    "- reasoning: optional: any supporting analysis.\n"
+)
+
+ANALYSIS_INSTRUCTION = (
+    ANALYSIS_GUIDE
+    + "\nOutput must be a JSON object with the following fields, ALL FIELDS MUST BE PRESENT:\n"
+    + ANALYSIS_FIELDS
+)
+
+
 @weave.op
-def analyze_prompt(prompt: str, is_system_prompt: bool = False) -> PromptAnalysis:
-    client = OpenAI()
+@instrumented
+def analyze_prompt(
+    prompt: str, is_system_prompt: bool = False, use_cache: bool = True
+) -> PromptAnalysis:
+    if count_tokens(prompt) > MAX_ANALYSIS_TOKENS:
+        return analyze_prompt_chunked(prompt, use_cache=use_cache)
+
+    # The prompt goes in its own message so the long instruction is an
+    # identical prefix on every call, which the API can cache
+    return _chat_completion(
+        [
+            {"role": "system", "content": ANALYSIS_INSTRUCTION},
+            {"role": "user", "content": f"Prompt to analyze: {prompt}"},
+        ],
+        schema=PromptAnalysis,
+        use_cache=use_cache,
+    )
 
-    system_instruction = (
-        "LLMs can be viewed as continuous, interpolative databases that store both data and vector-based programs. "
-        "Unlike traditional databases, data is stored as points in a vector space, enabling interpolation between concepts. "
-        "Prompts act as search queries in this space. Use this information to analyze the prompt, to provide information "
-        "so that we can generate a better prompt. Include: \n"
-        "- **Program Key**: Identifies the instruction that points to a specific behavior in program space.\n"
-        "- **Program Inputs**: The data or context the program will act on.\n"
-        "- **Risk of Hallucination**: Assessment of where interpolation may cause errors or unexpected outputs.\n"
-        "- **Hallucination Targets**: Specific text targets that are at risk of hallucination.\n"
-        "- **Program improvement ideas**: Ideas for improving the prompt.\n"
-        "\nOutput must be a JSON object with the following fields, ALL FIELDS MUST BE PRESENT:\n"
-        "- program_key: A concise identifier for the type of operation.\n"
-        "- program_inputs: List of identified inputs in the prompt.\n"
-        "- hallucination_risk: Assessment of hallucination risk with specific text targets.\n"
-        "- hallucination_targets: List of hallucination targets in the text.\n"
-        "- program_improvement_ideas: Ideas for improving the prompt.\n"
-        "- reasoning: optional: any supporting analysis.\n"
-        f"\nPrompt to analyze: {prompt}"
+
+@weave.op
+@instrumented
+def analyze_prompt_chunk(
+    chunk: str, part: int, parts: int, use_cache: bool = True
+) -> PromptAnalysis:
+    return _chat_completion(
+        [
+            {"role": "system", "content": ANALYSIS_INSTRUCTION},
+            {
+                "role": "user",
+                "content": f"Part {part} of {parts} of a longer prompt to analyze: {chunk}",
+            },
+        ],
+        schema=PromptAnalysis,
+        use_cache=use_cache,
     )
 
-    response = client.chat.completions.create(
-        model=MODEL,
-        response_format={"type": "json_object"},
-        messages=[{"role": "system", "content": system_instruction}],
+
+def merge_analyses(analyses: list[PromptAnalysis]) -> PromptAnalysis:
+    """Combine the analyses of a prompt's chunks into one analysis.
+
+    The program key is the one most chunks agree on, earliest first on a tie;
+    list fields are concatenated without duplicates.
+    """
+
+    def merged(field: str) -> list[str]:
+        return list(dict.fromkeys(v for a in analyses for v in getattr(a, field)))
+
+    keys = collections.Counter(a.program_key for a in analyses)
+    return PromptAnalysis(
+        program_key=keys.most_common(1)[0][0],
+        program_inputs=merged("program_inputs"),
+        hallucination_risk="\n".join(
+            dict.fromkeys(a.hallucination_risk for a in analyses)
+        ),
+        hallucination_targets=merged("hallucination_targets"),
+        program_improvement_ideas=merged("program_improvement_ideas"),
+        reasoning="\n".join(a.reasoning for a in analyses if a.reasoning) or None,
     )
 
-    # Parse the JSON response into our Pydantic model
-    analysis = PromptAnalysis.model_validate_json(response.choices[0].message.content)
-    return analysis
+
+@weave.op
+def analyze_prompt_chunked(
+    prompt: str, max_tokens: Optional[int] = None, use_cache: bool = True
+) -> PromptAnalysis:
+    """Analyze a prompt too long for one call as chunks in parallel."""
+    chunks = split_text(prompt, max_tokens or MAX_ANALYSIS_TOKENS)
+    with weave.ThreadPoolExecutor(max_workers=min(len(chunks), 8)) as executor:
+        futures = [
+            executor.submit(analyze_prompt_chunk, chunk, part, len(chunks), use_cache)
+            for part, chunk in enumerate(chunks, 1)
+        ]
+        return merge_analyses([future.result() for future in futures])
+
+
+@weave.op
+@instrumented
+def analyze_prompt_delta(
+    previous_analysis: PromptAnalysis,
+    previous_prompt: str,
+    prompt: str,
+    use_cache: bool = True,
+) -> PromptAnalysis:
+    """Update an existing analysis for a lightly edited prompt.
+
+    Sends the previous analysis and a diff instead of the full analysis
+    instruction and prompt.
+    """
+    system_instruction = (
+        "You previously analyzed a prompt, which has since been edited. "
+        "Update the previous analysis to reflect the edit, changing only what "
+        "the edit affects.\n"
+        "Output must be a JSON object with the same fields as the previous "
+        "analysis, ALL FIELDS MUST BE PRESENT: program_key, program_inputs, "
+        "hallucination_risk, hallucination_targets, program_improvement_ideas, "
+        "reasoning."
+    )
+    diff = "\n".join(
+        difflib.unified_diff(
+            previous_prompt.splitlines(), prompt.splitlines(), lineterm="", n=1
+        )
+    )
+    update_request = (
+        f"Previous analysis:\n{previous_analysis.model_dump_json()}\n\n"
+        f"Edit (unified diff):\n{diff}"
+    )
+
+    return _chat_completion(
+        [
+            {"role": "system", "content": system_instruction},
+            {"role": "user", "content": update_request},
+        ],
+        schema=PromptAnalysis,
+        use_cache=use_cache,
+    )
 
 
 class OptimizedPrompt(BaseModel):
@@ -70,17 +464,28 @@ class OptimizedPrompt(BaseModel):
     improvements: list[str]
 
 
+# OptimizedPrompt fields as described to the model
+OPTIMIZED_FIELDS = (
+    "- original_prompt: The input prompt being optimized\n"
+    "- optimized_prompt: The improved prompt text\n"
+    "- improvements: List of specific improvements made\n"
+)
+
+
 @weave.op
-def optimize_prompt(analysis: PromptAnalysis, original_prompt: str) -> OptimizedPrompt:
-    client = OpenAI()
+@instrumented
+def optimize_prompt(
+    analysis: PromptAnalysis,
+    original_prompt: str,
+    use_cache: bool = True,
+    temperature: Optional[float] = None,
+    focus: Optional[str] = None,
+) -> OptimizedPrompt:
 
     system_instruction = (
         "You are a prompt optimization expert. Using the provided prompt analysis, "
         "create an improved version of the original prompt. \n"
-        "\nOutput must be a JSON object with:\n"
-        "- original_prompt: The input prompt being optimized\n"
-        "- optimized_prompt: The improved prompt text\n"
-        "- improvements: List of specific improvements made\n"
+        "\nOutput must be a JSON object with:\n" + OPTIMIZED_FIELDS
     )
 
     # Convert analysis to a readable format for the AI
@@ -94,19 +499,49 @@ def optimize_prompt(analysis: PromptAnalysis, original_prompt: str) -> Optimized
         f"- Program Improvement Ideas: {', '.join(analysis.program_improvement_ideas)}\n"
         f"- Reasoning: {analysis.reasoning or 'Not provided'}"
     )
+    if focus:
+        analysis_summary += f"\n\nFocus the rewrite on this improvement: {focus}"
 
-    response = client.chat.completions.create(
-        model=MODEL,
-        response_format={"type": "json_object"},
-        messages=[
+    params = {} if temperature is None else {"temperature": temperature}
+    return _chat_completion(
+        [
             {"role": "system", "content": system_instruction},
             {"role": "user", "content": analysis_summary},
         ],
+        schema=OptimizedPrompt,
+        use_cache=use_cache,
+        **params,
     )
 
-    # Parse the response and ensure original_prompt is included
-    response_data = response.choices[0].message.content
-    return OptimizedPrompt.model_validate_json(response_data)
+
+class FusedOptimization(BaseModel):
+    analysis: PromptAnalysis
+    optimized: OptimizedPrompt
+
+
+@weave.op
+@instrumented
+def analyze_and_optimize(prompt: str, use_cache: bool = True) -> FusedOptimization:
+    """analyze_prompt and optimize_prompt in a single round trip."""
+    system_instruction = ANALYSIS_GUIDE + (
+        "\nThen, as a prompt optimization expert, use your analysis to create an "
+        "improved version of the prompt. Return both the analysis and the "
+        "optimized prompt.\n"
+        "\nOutput must be a JSON object with two objects, ALL FIELDS MUST BE PRESENT:\n"
+        "- analysis:\n"
+        + textwrap.indent(ANALYSIS_FIELDS, "  ")
+        + "- optimized:\n"
+        + textwrap.indent(OPTIMIZED_FIELDS, "  ")
+    )
+
+    return _chat_completion(
+        [
+            {"role": "system", "content": system_instruction},
+            {"role": "user", "content": f"Prompt to analyze: {prompt}"},
+        ],
+        schema=FusedOptimization,
+        use_cache=use_cache,
+    )
 
 
 class PromptComparison(BaseModel):
@@ -114,90 +549,385 @@ class PromptComparison(BaseModel):
     optimized_output: str
 
 
+def _output_messages(system_prompt: Optional[str], user_prompt: str) -> list[dict]:
+    messages = []
+    if system_prompt:
+        messages.append({"role": "system", "content": system_prompt})
+    messages.append({"role": "user", "content": user_prompt})
+    return messages
+
+
+@weave.op
+@instrumented
+def generate_output(user_prompt: str, system_prompt: Optional[str] = None) -> str:
+    # Never cached: sampled outputs are what the player is comparing
+    return _chat_completion(_output_messages(system_prompt, user_prompt))
+
+
+class StreamedOutput(BaseModel):
+    output: str
+    # Seconds from request start to the first content token
+    time_to_first_token: Optional[float] = None
+    total_time: float
+
+
+def _stream_completion(
+    messages: list[dict], on_token: Callable[[str], None]
+) -> StreamedOutput:
+    started = time.perf_counter()
+    estimated_tokens = estimate_tokens(messages)
+    # Released on the scheduler that admitted the stream
+    admitted_by = scheduler
+    # Admission, retries and fallback cover opening the stream; its slot is
+    # held until it has been read
+    stream, timing, fallback, _ = _routed_create(
+        _route(messages),
+        messages,
+        hold_slot=True,
+        stream=True,
+        stream_options={"include_usage": True},
+    )
+
+    parts = []
+    time_to_first_token = None
+    usage = None
+    try:
+        for chunk in stream:
+            if chunk.usage:
+                usage = chunk.usage
+                admitted_by.tokens.adjust(chunk.usage.total_tokens - estimated_tokens)
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - started
+            parts.append(chunk.choices[0].delta.content)
+            on_token(chunk.choices[0].delta.content)
+    finally:
+        admitted_by.release()
+    record_call(_call_metrics(usage, timing, fallback))
+
+    return StreamedOutput(
+        output="".join(parts),
+        time_to_first_token=time_to_first_token,
+        total_time=time.perf_counter() - started,
+    )
+
+
+@weave.op
+@instrumented
+def stream_output(
+    user_prompt: str,
+    system_prompt: Optional[str] = None,
+    on_token: Callable[[str], None] = lambda token: None,
+) -> StreamedOutput:
+    """Like generate_output, but calls `on_token` with each token as it arrives."""
+    return _stream_completion(_output_messages(system_prompt, user_prompt), on_token)
+
+
 @weave.op
 def compare_outputs(
-    prompt_pair: PromptPair, optimized_system_prompt: Optional[str] = None
+    prompt_pair: PromptPair,
+    optimized_system_prompt: Optional[str] = None,
+    concurrent: bool = True,
 ) -> PromptComparison:
-    client = OpenAI()
-
-    # Prepare messages for original prompt
-    original_messages = []
-    if prompt_pair.system_prompt:
-        original_messages.append(
-            {"role": "system", "content": prompt_pair.system_prompt}
+    if not concurrent:
+        return PromptComparison(
+            original_output=generate_output(
+                prompt_pair.user_prompt, prompt_pair.system_prompt
+            ),
+            optimized_output=generate_output(
+                prompt_pair.user_prompt, optimized_system_prompt
+            ),
         )
-    original_messages.append({"role": "user", "content": prompt_pair.user_prompt})
-
-    # Get response for original prompt
-    original_response = client.chat.completions.create(
-        model=MODEL, messages=original_messages
-    )
 
-    # Prepare messages for optimized prompt
-    optimized_messages = []
-    if optimized_system_prompt:
-        optimized_messages.append(
-            {"role": "system", "content": optimized_system_prompt}
+    # The two completions are independent, so run them side by side and only
+    # wait for the slower one. weave's executor carries the op context into
+    # the worker threads so the calls stay nested under this trace.
+    with weave.ThreadPoolExecutor(max_workers=2) as executor:
+        original_future = executor.submit(
+            generate_output, prompt_pair.user_prompt, prompt_pair.system_prompt
+        )
+        optimized_future = executor.submit(
+            generate_output, prompt_pair.user_prompt, optimized_system_prompt
+        )
+        return PromptComparison(
+            original_output=original_future.result(),
+            optimized_output=optimized_future.result(),
         )
-    optimized_messages.append({"role": "user", "content": prompt_pair.user_prompt})
 
-    # Get response for optimized prompt
-    optimized_response = client.chat.completions.create(
-        model=MODEL, messages=optimized_messages
-    )
 
-    return PromptComparison(
-        original_output=original_response.choices[0].message.content,
-        optimized_output=optimized_response.choices[0].message.content,
+@weave.op
+def compare_outputs_stream(
+    prompt_pair: PromptPair, optimized_system_prompt: Optional[str] = None
+) -> Iterator[tuple[str, str]]:
+    """Streaming compare_outputs: yields ("original" | "optimized", token) pairs
+    as both completions stream concurrently."""
+    tokens: queue.Queue = queue.Queue()
+    sides = {
+        "original": prompt_pair.system_prompt,
+        "optimized": optimized_system_prompt,
+    }
+
+    with weave.ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(
+                stream_output,
+                prompt_pair.user_prompt,
+                system_prompt,
+                lambda token, side=side: tokens.put((side, token)),
+            )
+            for side, system_prompt in sides.items()
+        ]
+        while not all(future.done() for future in futures) or not tokens.empty():
+            try:
+                yield tokens.get(timeout=0.05)
+            except queue.Empty:
+                continue
+        for future in futures:
+            # Surface any stream error
+            future.result()
+
+
+def _evaluation_request(
+    prompt_pair: PromptPair, original_output: str, optimized_output: str
+) -> str:
+    # Long outputs are judged on their start and end
+    return (
+        f"System Prompt: {prompt_pair.system_prompt or 'None'}\n"
+        f"User Prompt: {prompt_pair.user_prompt}\n\n"
+        f"Input 1:\n{truncate(original_output, MAX_JUDGED_OUTPUT_TOKENS)}\n\n"
+        f"Input 2:\n{truncate(optimized_output, MAX_JUDGED_OUTPUT_TOKENS)}"
     )
 
 
+# Judge scores; out-of-range scores are clamped by structured.repair
+Score = Annotated[int, Field(ge=1, le=100)]
+
+
 class OutputScore(BaseModel):
-    input_1: int
-    input_2: int
+    input_1: Score
+    input_2: Score
     comparison_notes: list[str]
     winner: str
 
 
+# What every judging op scores outputs on, so their scores stay comparable
+JUDGE_CRITERIA = """1. Adherence to the original prompt's intent
+2. Quality and creativity of the response
+3. Coherence and clarity
+4. Appropriate style and tone
+"""
+
+# OutputScore fields as described to the model
+SCORE_FIELDS = """- input_1: integer score 1-100 for the first output
+- input_2: integer score 1-100 for the second output
+- comparison_notes: list of strings, where each string is a specific observation about the differences between the outputs
+- winner: string indicating which version was better ("input_1", "input_2", or "tie")
+"""
+
+
 @weave.op
+@instrumented
 def score_outputs(
-    prompt_pair: PromptPair, original_output: str, optimized_output: str
+    prompt_pair: PromptPair,
+    original_output: str,
+    optimized_output: str,
+    use_cache: bool = True,
 ) -> OutputScore:
-    client = OpenAI()
-
-    system_instruction = """You are an expert prompt output evaluator. Score two different outputs based on:
-    1. Adherence to the original prompt's intent
-    2. Quality and creativity of the response
-    3. Coherence and clarity
-    4. Appropriate style and tone
-    
-    Score each output from 1-100 and provide specific reasons for the scoring.
-    
-    Output must be a JSON object with:
-    - input_1: integer score 1-100 for the first output
-    - input_2: integer score 1-100 for the second output
-    - comparison_notes: list of strings, where each string is a specific observation about the differences between the outputs
-    - winner: string indicating which version was better ("input_1", "input_2", or "tie")
+
+    system_instruction = (
+        "You are an expert prompt output evaluator. Score two different outputs based on:\n"
+        + JUDGE_CRITERIA
+        + "\nScore each output from 1-100 and provide specific reasons for the scoring.\n"
+        "\nOutput must be a JSON object with:\n" + SCORE_FIELDS
+    )
+
+    return _chat_completion(
+        [
+            {"role": "system", "content": system_instruction},
+            {
+                "role": "user",
+                "content": _evaluation_request(
+                    prompt_pair, original_output, optimized_output
+                ),
+            },
+        ],
+        schema=OutputScore,
+        use_cache=use_cache,
+    )
+
+
+# (prompt pair, original output, optimized output) to be judged
+ScoreItem = tuple[PromptPair, str, str]
+
+
+class ItemScore(OutputScore):
+    # 1-based number of the comparison in the request
+    item: int
+
+
+class BatchScores(BaseModel):
+    scores: list[ItemScore]
+
+
+@weave.op
+@instrumented
+def score_outputs_packed(
+    items: list[ScoreItem], use_cache: bool = True
+) -> list[Optional[OutputScore]]:
+    """Judge several comparisons in one request.
+
+    Items the judge skipped or numbered wrongly come back as None.
+    """
+    system_instruction = (
+        f"You are an expert evaluator judging {len(items)} independent comparisons. "
+        "In each comparison, score two different outputs based on:\n"
+        + JUDGE_CRITERIA
+        + "\nScore each output from 1-100 and judge each comparison on its own.\n"
+        "\nOutput must be a JSON object with:\n"
+        "- scores: list with one object per comparison, each with:\n"
+        f"  - item: the comparison number (1-{len(items)})\n"
+        + textwrap.indent(SCORE_FIELDS, "  ")
+    )
+
+    batch_request = "\n\n".join(
+        f"Comparison {i}:\n{_evaluation_request(*item)}"
+        for i, item in enumerate(items, 1)
+    )
+
+    batch = _chat_completion(
+        [
+            {"role": "system", "content": system_instruction},
+            {"role": "user", "content": batch_request},
+        ],
+        schema=BatchScores,
+        use_cache=use_cache,
+    )
+    scores: list[Optional[OutputScore]] = [None] * len(items)
+    for score in batch.scores:
+        if 1 <= score.item <= len(items):
+            scores[score.item - 1] = OutputScore.model_validate(
+                score.model_dump(exclude={"item"})
+            )
+    return scores
+
+
+def pack_items(sizes: list[int], token_budget: int, max_items: int) -> list[list[int]]:
+    """Group item indexes, in order, into batches of at most `token_budget`
+    tokens and `max_items` items. An item over the budget gets its own batch."""
+    batches: list[list[int]] = []
+    batch_tokens = 0
+    for index, size in enumerate(sizes):
+        if (
+            not batches
+            or len(batches[-1]) >= max_items
+            or batch_tokens + size > token_budget
+        ):
+            batches.append([])
+            batch_tokens = 0
+        batches[-1].append(index)
+        batch_tokens += size
+    return batches
+
+
+@weave.op
+def score_outputs_batch(
+    items: list[ScoreItem],
+    token_budget: Optional[int] = None,
+    max_items: Optional[int] = None,
+    max_concurrency: int = 4,
+    use_cache: bool = True,
+) -> list[Union[OutputScore, Exception]]:
+    """score_outputs for many comparisons in as few judge requests as fit.
+
+    Items are packed into requests of at most `token_budget` prompt tokens
+    and `max_items` comparisons, which share one judge instruction. An item
+    missing from its batch's response, or in a batch that failed, is scored
+    on its own; if that fails too its slot holds the exception, so one bad
+    item never fails the rest.
     """
+    sizes = [count_tokens(_evaluation_request(*item)) for item in items]
+    batches = pack_items(
+        sizes,
+        token_budget or JUDGE_BATCH_TOKENS,
+        max_items or JUDGE_BATCH_MAX_ITEMS,
+    )
+
+    def score_batch(indexes: list[int]) -> list[Union[OutputScore, Exception]]:
+        try:
+            scores = score_outputs_packed(
+                [items[i] for i in indexes], use_cache=use_cache
+            )
+        except Exception:
+            scores = [None] * len(indexes)
+        results = []
+        for index, score in zip(indexes, scores):
+            if score is None:
+                try:
+                    score = score_outputs(*items[index], use_cache=use_cache)
+                except Exception as e:
+                    score = e
+            results.append(score)
+        return results
+
+    results: list[Union[OutputScore, Exception]] = []
+    with weave.ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        for batch_results in executor.map(score_batch, batches):
+            results.extend(batch_results)
+    return results
+
+
+class OutputRanking(BaseModel):
+    # One 1-100 score per output, in the order they were given
+    scores: list[Score]
+    # 1-based number of the best output
+    winner: int
+    comparison_notes: list[str]
 
-    evaluation_request = (
+
+@weave.op
+@instrumented
+def rank_outputs(
+    prompt_pair: PromptPair, outputs: list[str], use_cache: bool = True
+) -> OutputRanking:
+    """Judge any number of outputs for the same user prompt in one call,
+    instead of one score_outputs call per pair."""
+    system_instruction = (
+        f"You are an expert judge ranking {len(outputs)} outputs produced for "
+        "the same prompt. Score each output based on:\n"
+        + JUDGE_CRITERIA
+        + "\nOutput must be a JSON object with:\n"
+        f"- scores: list of {len(outputs)} integer scores 1-100, one per output, in order\n"
+        f"- winner: the number of the best output (1-{len(outputs)})\n"
+        "- comparison_notes: list of strings, each a specific observation comparing the outputs\n"
+    )
+
+    ranking_request = (
         f"System Prompt: {prompt_pair.system_prompt or 'None'}\n"
         f"User Prompt: {prompt_pair.user_prompt}\n\n"
-        f"Input 1:\n{original_output}\n\n"
-        f"Input 2:\n{optimized_output}"
+    ) + "\n\n".join(
+        f"Output {i}:\n{truncate(output, MAX_JUDGED_OUTPUT_TOKENS)}"
+        for i, output in enumerate(outputs, 1)
     )
 
-    response = client.chat.completions.create(
-        model=MODEL,
-        response_format={"type": "json_object"},
-        messages=[
+    def parse_ranking(content: str) -> OutputRanking:
+        ranking = OutputRanking.model_validate_json(content)
+        if len(ranking.scores) != len(outputs) or not (
+            1 <= ranking.winner <= len(outputs)
+        ):
+            raise ValueError(f"Invalid ranking for {len(outputs)} outputs: {content}")
+        return ranking
+
+    return _chat_completion(
+        [
             {"role": "system", "content": system_instruction},
-            {"role": "user", "content": evaluation_request},
+            {"role": "user", "content": ranking_request},
         ],
+        parse=parse_ranking,
+        schema=OutputRanking,
+        use_cache=use_cache,
     )
 
-    return OutputScore.model_validate_json(response.choices[0].message.content)
-
 
 @weave.op
 def run_prompt_optimization(prompt_pair: PromptPair):
@@ -257,7 +987,7 @@ def run_prompt_optimization(prompt_pair: PromptPair):
 
 def main():
     try:
-        weave.init("prompter-dev")
+        init_tracing("prompter-dev")
         print("Enter a system prompt (optional):")
         system_prompt = input("> ") or None
         print("Enter a user prompt:")
@@ -267,6 +997,9 @@ def main():
     except KeyboardInterrupt:
         print("\nProgram interrupted by user. Exiting gracefully...")
         return
+    except openai.RateLimitError as e:
+        print(f"\nStill rate limited after {scheduler.max_retries} retries: {e}")
+        return
     except Exception as e:
         print(f"\nAn error occurred: {e}")
         return
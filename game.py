@@ -1,15 +1,58 @@
+import contextlib
+import os
+import random
+import time
+from typing import Optional
+
 import streamlit as st
 import weave
-from exp import PromptPair, DEFAULT_SYSTEM_PROMPT, DEFAULT_USER_PROMPT
-from utils import AnalysisData, generate_responses, Choice
+
+from evalstore import EvalStore, PlayerEval
+from exp import (
+    DEFAULT_SYSTEM_PROMPT,
+    DEFAULT_USER_PROMPT,
+    PromptPair,
+    configure_client,
+    get_client,
+)
+from jobs import JobQueue, JobStatus
+from metrics import serve_metrics
+from prefetch import Prefetcher
+from tracing import init_tracing, tracing_ready
+from utils import AnalysisData, Choice
 
 PROJECT_ID = "sparc/prompter-app"
-client = weave.init(PROJECT_ID)
+# Seconds a round may take; a judge still running then is dropped and the
+# round is shown without scores
+ROUND_DEADLINE = float(os.environ.get("PROMPTER_ROUND_DEADLINE", "60"))
 
 # Set page to wide mode
 st.set_page_config(layout="wide")
 
 
+@st.cache_resource
+def init_backend():
+    """Start tracing and create the OpenAI client once per server process"""
+    init_tracing(PROJECT_ID)
+    if os.environ.get("PROMPTER_METRICS_PORT"):
+        serve_metrics(int(os.environ["PROMPTER_METRICS_PORT"]))
+    configure_client(max_connections=100, max_keepalive_connections=50)
+    return get_client()
+
+
+@st.cache_resource
+def job_queue() -> JobQueue:
+    """Background workers shared by all sessions, so script threads never
+    block on a whole round"""
+    return JobQueue(workers=int(os.environ.get("PROMPTER_JOB_WORKERS", "16")))
+
+
+@st.cache_resource
+def eval_store() -> EvalStore:
+    """Player evaluations from every session, written in the background"""
+    return EvalStore(os.environ.get("PROMPTER_EVAL_DB", ".prompter_evals.sqlite"))
+
+
 def initialize_session_state():
     """Initialize session state variables"""
     if "current_stage" not in st.session_state:
@@ -22,6 +65,50 @@ def initialize_session_state():
         st.session_state.previous_system_prompt = DEFAULT_SYSTEM_PROMPT
     if "previous_user_prompt" not in st.session_state:
         st.session_state.previous_user_prompt = DEFAULT_USER_PROMPT
+    if "swap_responses" not in st.session_state:
+        st.session_state.swap_responses = False
+    if "backend_calls" not in st.session_state:
+        st.session_state.backend_calls = []
+    if "prefetcher" not in st.session_state:
+        st.session_state.prefetcher = Prefetcher()
+    if "last_round" not in st.session_state:
+        # Analysis of the last submitted prompt, diffed against on resubmit
+        st.session_state.last_round = None
+    if "recorded_round" not in st.session_state:
+        # Job id of the last round saved to the eval store; the analysis page
+        # reruns on every interaction and must only record once
+        st.session_state.recorded_round = None
+
+
+def prefetch_next_round(*prompts: str):
+    """Precompute analysis for prompts the player is likely to submit next.
+
+    The prompt analyzed is the system prompt, or the user prompt when there is
+    none. Anything not listed here is cancelled. Prompts are planned against
+    the last round like the round itself, so an edit gets a delta analysis.
+    """
+    st.session_state.prefetcher.prefetch(
+        [
+            st.session_state.previous_system_prompt
+            or st.session_state.previous_user_prompt,
+            *prompts,
+        ],
+        previous=st.session_state.last_round,
+    )
+
+
+def record_backend_time(name: str, seconds: float):
+    st.session_state.backend_calls.append({"call": name, "seconds": round(seconds, 3)})
+
+
+@contextlib.contextmanager
+def backend_call(name: str):
+    """Record how long the page spends waiting on a backend call"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_backend_time(name, time.perf_counter() - started)
 
 
 def display_header():
@@ -58,21 +145,77 @@ def get_user_prompts():
     )
 
 
+def response_sides():
+    """The (column A, column B) order of the responses for this round"""
+    if st.session_state.swap_responses:
+        return "optimized", "original"
+    return "original", "optimized"
+
+
 def display_responses(original, optimized):
     """Display the responses in side-by-side columns"""
+    texts = {"original": original, "optimized": optimized}
     col1, col2 = st.columns(2)
 
-    # Randomly assign responses to columns
-    if hash(original) % 2 == 0:
-        col1.text_area("Response A:", value=original, height=200, disabled=True)
-        col2.text_area("Response B:", value=optimized, height=200, disabled=True)
-        col1.slider("Rate response A:", 1, 10, key="slider_original")
-        col2.slider("Rate response B:", 1, 10, key="slider_optimized")
+    # Responses are randomly assigned to columns at submit time
+    side_a, side_b = response_sides()
+    col1.text_area("Response A:", value=texts[side_a], height=200, disabled=True)
+    col2.text_area("Response B:", value=texts[side_b], height=200, disabled=True)
+    col1.slider("Rate response A:", 1, 10, key=f"slider_{side_a}")
+    col2.slider("Rate response B:", 1, 10, key=f"slider_{side_b}")
+
+
+def submit_round(prompt_pair: PromptPair):
+    """Queue generate_responses for this session and switch to the waiting stage"""
+    st.session_state.swap_responses = random.random() < 0.5
+    st.session_state.job_id = job_queue().submit(
+        prompt_pair,
+        prefetcher=st.session_state.prefetcher,
+        previous=st.session_state.last_round,
+        deadline=ROUND_DEADLINE,
+    )
+    st.session_state.current_stage = "generating"
+
+
+def show_job_progress():
+    """Render the outputs streamed so far, rerunning until the round is done"""
+    job = job_queue().get(st.session_state.job_id)
+    if job is None:
+        st.session_state.current_stage = "input"
+        st.rerun()
+
+    if job.status == JobStatus.DONE:
+        res = job.result
+        record_backend_time("generate_responses", job.finished_at - job.submitted_at)
+        st.session_state.original = res.original_output
+        st.session_state.optimized = res.optimized_output
+        st.session_state.analysis_data = res
+        st.session_state.last_round = res.prior_round
+        st.session_state.current_stage = "evaluate"
+        st.rerun()
+
+    if job.status == JobStatus.FAILED:
+        st.error(f"Something went wrong: {job.error}")
+        if st.button("Try again"):
+            st.session_state.current_stage = "input"
+            st.rerun()
+        return
+
+    col1, col2 = st.columns(2)
+    side_a, side_b = response_sides()
+    col1.markdown("**Response A:**")
+    col1.markdown(job.partial[side_a])
+    col2.markdown("**Response B:**")
+    col2.markdown(job.partial[side_b])
+    if job.status == JobStatus.QUEUED:
+        st.caption(f"Waiting for a worker ({job_queue().pending()} rounds queued)...")
+    elif job.partial["original"] and job.partial["optimized"]:
+        st.caption("Scoring responses...")
     else:
-        col1.text_area("Response A:", value=optimized, height=200, disabled=True)
-        col2.text_area("Response B:", value=original, height=200, disabled=True)
-        col1.slider("Rate response A:", 1, 10, key="slider_optimized")
-        col2.slider("Rate response B:", 1, 10, key="slider_original")
+        st.caption("Working our magic...")
+
+    time.sleep(0.25)
+    st.rerun()
 
 
 @weave.op
@@ -89,6 +232,53 @@ def get_user_eval(score_optimized: int, score_original: int):
     }
 
 
+def record_user_eval(analysis_data: AnalysisData, user_eval: dict):
+    """Queue this round's evaluation for the eval store, once per round"""
+    round_id = st.session_state.get("job_id")
+    if round_id is None or st.session_state.recorded_round == round_id:
+        return
+    eval_store().record(
+        PlayerEval(
+            round_id=round_id,
+            analysis_data=analysis_data,
+            player_original=user_eval["score_original"],
+            player_optimized=user_eval["score_optimized"],
+        )
+    )
+    st.session_state.recorded_round = round_id
+
+
+def show_leaderboard():
+    """Aggregate results across all players from the eval store"""
+    store = eval_store()
+    overall = store.overall()
+    st.markdown("### Is prompt engineering dead?")
+    if not overall.rounds:
+        st.markdown("No rounds recorded yet.")
+        return
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Rounds played", overall.rounds)
+    col2.metric(
+        "Players preferring optimized", f"{overall.player_optimized_win_rate:.0%}"
+    )
+    col3.metric("Judge preferring optimized", f"{overall.judge_optimized_win_rate:.0%}")
+    leaderboard = store.leaderboard(limit=20)
+    st.table(
+        {
+            "Program key": [p.program_key for p in leaderboard],
+            "Rounds": [p.rounds for p in leaderboard],
+            "Players prefer optimized": [
+                f"{p.player_optimized_win_rate:.0%}" for p in leaderboard
+            ],
+            "Judge prefers optimized": [
+                f"{p.judge_optimized_win_rate:.0%}" for p in leaderboard
+            ],
+            "Mean player delta": [f"{p.mean_player_delta:+.1f}" for p in leaderboard],
+            "Mean judge delta": [f"{p.mean_judge_delta:+.1f}" for p in leaderboard],
+        }
+    )
+
+
 def show_analysis(original_prompt_pair: PromptPair):
     """Show the analysis of the prompt optimization..."""
 
@@ -103,7 +293,10 @@ def show_analysis(original_prompt_pair: PromptPair):
     if score_optimized == -1 or score_original == -1:
         st.session_state.current_stage = "input"
 
-    user_eval = get_user_eval(score_optimized, score_original)
+    with backend_call("get_user_eval"):
+        user_eval = get_user_eval(score_optimized, score_original)
+    if score_optimized != -1 and score_original != -1:
+        record_user_eval(analysis_data, user_eval)
 
     # Display winner
     if not user_eval["user_chose_optimized"]:
@@ -113,8 +306,13 @@ def show_analysis(original_prompt_pair: PromptPair):
 
     # Display scores in a compact format
     col1, col2 = st.columns(2)
-    col1.metric("Original score", f"{analysis_data.original_score}/100")
-    col2.metric("Optimized score", f"{analysis_data.optimized_score}/100")
+    if analysis_data.partial:
+        st.warning("The judge ran out of time this round, so there are no scores.")
+        col1.metric("Original score", "-")
+        col2.metric("Optimized score", "-")
+    else:
+        col1.metric("Original score", f"{analysis_data.original_score}/100")
+        col2.metric("Optimized score", f"{analysis_data.optimized_score}/100")
 
     # Display prompts
     st.subheader("Prompts")
@@ -169,20 +367,25 @@ def show_analysis(original_prompt_pair: PromptPair):
     st.table(analysis_table)
 
     # Display comparison notes
-    st.write("### Comparison notes")
-    for note in analysis_data.comparison_notes:
-        st.write(f"- {note}")
+    if analysis_data.comparison_notes:
+        st.write("### Comparison notes")
+        for note in analysis_data.comparison_notes:
+            st.write(f"- {note}")
 
     # View weave traces
     st.markdown("---")
     st.markdown("### View weave traces")
-    base = f"https://wandb.ai/{PROJECT_ID}/r/call/"
-    op_name = f"weave:///{PROJECT_ID}/op/generate_responses:*"
-    call = client.get_calls(
-        filter={"op_names": [op_name]},
-        sort_by=[{"field": "started_at", "direction": "desc"}],
-    )[0]
-    st.markdown(f"[{base}{call.id}]({base}{call.id})")
+    # The call id was captured when the round ran, so no remote lookup is needed
+    if analysis_data.call_id:
+        url = f"https://wandb.ai/{PROJECT_ID}/r/call/{analysis_data.call_id}"
+        st.markdown(f"[{url}]({url})")
+    elif tracing_ready():
+        st.markdown("This round ran before tracing had started.")
+    else:
+        st.markdown("Tracing is not active.")
+
+    st.markdown("---")
+    show_leaderboard()
 
     # Add challenge message and restart button
     st.markdown("---")
@@ -196,22 +399,58 @@ def show_analysis(original_prompt_pair: PromptPair):
         st.rerun()
 
 
+def show_metrics(analysis_data: Optional[AnalysisData] = None):
+    """Sidebar panel with time spent on backend calls"""
+    calls = st.session_state.backend_calls
+    st.sidebar.metric(
+        "Backend time this session", f"{sum(c['seconds'] for c in calls):.2f}s"
+    )
+    if calls:
+        st.sidebar.table(calls[-10:])
+    if analysis_data and analysis_data.timings:
+        st.sidebar.text(analysis_data.timings.report())
+    if analysis_data and analysis_data.usage:
+        st.sidebar.table(
+            {
+                op: {
+                    "tokens": u.prompt_tokens + u.completion_tokens,
+                    "seconds": round(u.wall_time, 2),
+                    "queued": round(u.queued, 2),
+                    "cache hits": u.cache_hits,
+                }
+                for op, u in analysis_data.usage.by_op.items()
+            }
+        )
+    if analysis_data and analysis_data.incremental:
+        saved = analysis_data.incremental
+        st.sidebar.caption(
+            f"Analysis: {saved.mode} (similarity {saved.similarity:.0%}), "
+            f"saved ~{saved.tokens_saved} tokens / {saved.seconds_saved:.2f}s"
+        )
+
+
 def main():
+    init_backend()
     initialize_session_state()
     display_header()
+    if st.sidebar.checkbox("Show backend metrics", key="show_metrics"):
+        show_metrics(st.session_state.analysis_data)
 
     if st.session_state.current_stage == "input":
         prompt_pair = get_user_prompts()
+        # Start on the prompt in the text area while the player finishes
+        # editing; an edit cancels the stale prefetch
+        prefetch_next_round()
         if st.button("Generate responses"):
-            with st.spinner("Working our magic..."):
-                res = generate_responses(prompt_pair)
-                st.session_state.original = res.original_output
-                st.session_state.optimized = res.optimized_output
-                st.session_state.analysis_data = res
-                st.session_state.current_stage = "evaluate"
+            submit_round(prompt_pair)
             st.rerun()
 
+    elif st.session_state.current_stage == "generating":
+        show_job_progress()
+
     elif st.session_state.current_stage == "evaluate":
+        # The backend is idle while the player reads and rates
+        prefetch_next_round(DEFAULT_SYSTEM_PROMPT)
         display_responses(st.session_state.original, st.session_state.optimized)
 
         if st.button("Show analysis"):
@@ -219,6 +458,7 @@ def main():
             st.rerun()
 
     elif st.session_state.current_stage == "analysis":
+        prefetch_next_round(DEFAULT_SYSTEM_PROMPT)
         show_analysis(st.session_state.analysis_data)
 
 
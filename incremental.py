@@ -0,0 +1,103 @@
+import difflib
+from typing import Optional
+
+from pydantic import BaseModel
+
+from exp import OptimizedPrompt, PromptAnalysis
+
+# Edits at least this similar to the previous prompt get a delta analysis
+DELTA_THRESHOLD = 0.8
+
+
+class PriorRound(BaseModel):
+    """What a round spent on analysis, kept to make the next round incremental."""
+
+    prompt: str
+    analysis: PromptAnalysis
+    optimized: OptimizedPrompt
+    analyze_seconds: float = 0.0
+    analyze_tokens: int = 0
+    optimize_seconds: float = 0.0
+    optimize_tokens: int = 0
+
+
+class IncrementalSavings(BaseModel):
+    # "full", "delta" (analysis updated from a diff) or "reused" (unchanged)
+    mode: str
+    similarity: float
+    tokens_saved: int = 0
+    seconds_saved: float = 0.0
+
+
+def similarity(previous_prompt: str, prompt: str) -> float:
+    return difflib.SequenceMatcher(None, previous_prompt, prompt).ratio()
+
+
+def plan(prompt: str, previous: Optional[PriorRound]) -> tuple[str, float]:
+    """Pick how to analyze `prompt` given the previous round: returns the mode
+    ("full", "delta" or "reused") and the edit similarity."""
+    if previous is None:
+        return "full", 0.0
+    if previous.prompt == prompt:
+        return "reused", 1.0
+    ratio = similarity(previous.prompt, prompt)
+    return ("delta" if ratio >= DELTA_THRESHOLD else "full"), ratio
+
+
+def savings(
+    mode: str,
+    ratio: float,
+    previous: Optional[PriorRound],
+    analyze_cost: tuple[float, int],
+) -> IncrementalSavings:
+    """Tokens and seconds saved compared with re-running the previous round's
+    full analysis (and, for unchanged prompts, optimization).
+
+    `analyze_cost` is the (seconds, tokens) this round spent on analysis.
+    """
+    if previous is None or mode == "full":
+        return IncrementalSavings(mode=mode, similarity=ratio)
+    if mode == "reused":
+        return IncrementalSavings(
+            mode=mode,
+            similarity=ratio,
+            tokens_saved=previous.analyze_tokens + previous.optimize_tokens,
+            seconds_saved=previous.analyze_seconds + previous.optimize_seconds,
+        )
+    seconds, tokens = analyze_cost
+    return IncrementalSavings(
+        mode=mode,
+        similarity=ratio,
+        tokens_saved=previous.analyze_tokens - tokens,
+        seconds_saved=previous.analyze_seconds - seconds,
+    )
+
+
+def next_round(
+    prompt: str,
+    analysis: PromptAnalysis,
+    optimized: OptimizedPrompt,
+    mode: str,
+    previous: Optional[PriorRound],
+    analyze_cost: tuple[float, int],
+    optimize_cost: tuple[float, int],
+) -> PriorRound:
+    """The PriorRound to hand to the next round.
+
+    Costs always describe a full analysis and optimization, so savings stay
+    measured against the full pipeline; incremental rounds carry the last
+    full round's costs forward.
+    """
+    if previous is not None and mode != "full":
+        analyze_cost = (previous.analyze_seconds, previous.analyze_tokens)
+        if mode != "delta":
+            optimize_cost = (previous.optimize_seconds, previous.optimize_tokens)
+    return PriorRound(
+        prompt=prompt,
+        analysis=analysis,
+        optimized=optimized,
+        analyze_seconds=analyze_cost[0],
+        analyze_tokens=analyze_cost[1],
+        optimize_seconds=optimize_cost[0],
+        optimize_tokens=optimize_cost[1],
+    )
@@ -0,0 +1,131 @@
+import queue
+import threading
+import time
+import uuid
+from enum import Enum
+from typing import Callable, Optional
+
+from pydantic import BaseModel
+
+from exp import PromptPair
+from utils import AnalysisData, generate_responses
+
+
+class JobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
+class Job(BaseModel):
+    id: str
+    status: JobStatus = JobStatus.QUEUED
+    submitted_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    # Output text streamed so far, keyed "original"/"optimized"
+    partial: dict[str, str] = {"original": "", "optimized": ""}
+    result: Optional[AnalysisData] = None
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JobStatus.DONE, JobStatus.FAILED)
+
+
+class JobQueue:
+    """Runs generate_responses rounds on a pool of background workers.
+
+    Callers submit a PromptPair, get a job id back immediately and poll get()
+    for progress, so no request thread is held for the whole round. Jobs are
+    read from `job_queue`, any object with queue.Queue's put/get/task_done,
+    so a different local queue can be plugged in. Finished jobs are forgotten
+    `retention` seconds after they finish.
+    """
+
+    def __init__(
+        self,
+        workers: int = 8,
+        job_queue: Optional[queue.Queue] = None,
+        handler: Callable[..., AnalysisData] = generate_responses,
+        retention: float = 3600,
+    ):
+        self._queue = job_queue if job_queue is not None else queue.Queue()
+        self._handler = handler
+        self._retention = retention
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, prompt_pair: PromptPair, **kwargs) -> str:
+        """Queue a round; `kwargs` are passed on to generate_responses."""
+        job = Job(id=uuid.uuid4().hex, submitted_at=time.time())
+        with self._lock:
+            self._prune()
+            self._jobs[job.id] = job
+        self._queue.put((job.id, prompt_pair, kwargs))
+        return job.id
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """A snapshot of the job, or None if it is unknown or expired."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.model_copy(deep=True) if job else None
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _prune(self):
+        cutoff = time.time() - self._retention
+        for job_id, job in list(self._jobs.items()):
+            if job.finished and job.finished_at < cutoff:
+                del self._jobs[job_id]
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            for name, value in fields.items():
+                setattr(job, name, value)
+
+    def _append_token(self, job_id: str, side: str, token: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            # Streams abandoned at a round deadline keep going after the job
+            # has finished
+            if job is not None and not job.finished:
+                job.partial[side] += token
+
+    def _work(self):
+        while True:
+            job_id, prompt_pair, kwargs = self._queue.get()
+            try:
+                self._update(job_id, status=JobStatus.RUNNING, started_at=time.time())
+                result = self._handler(
+                    prompt_pair,
+                    # Bound now: the worker reuses job_id for its next job
+                    on_token=lambda side, token, job_id=job_id: self._append_token(
+                        job_id, side, token
+                    ),
+                    **kwargs,
+                )
+                self._update(
+                    job_id,
+                    status=JobStatus.DONE,
+                    result=result,
+                    finished_at=time.time(),
+                )
+            except Exception as e:
+                self._update(
+                    job_id,
+                    status=JobStatus.FAILED,
+                    error=str(e),
+                    finished_at=time.time(),
+                )
+            finally:
+                self._queue.task_done()
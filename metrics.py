@@ -0,0 +1,369 @@
+"""Token, latency and cache instrumentation for the LLM ops.
+
+Decorate an op with @instrumented (under @weave.op) and report each API call or
+cache hit inside it with record_call(). Per-op totals are:
+- added to the op's weave call summary under "prompter",
+- accumulated in the process-wide `registry`, exported in Prometheus text
+  format by write_metrics()/serve_metrics(),
+- summed into the RoundUsage of an enclosing collect_round() block.
+"""
+
+import bisect
+import contextlib
+import contextvars
+import functools
+import threading
+import time
+from collections.abc import Iterator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+import weave
+from pydantic import BaseModel
+
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class CallMetrics(BaseModel):
+    """One API call, cache hit or coalesced call made by an op."""
+
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    queued: float = 0.0
+    retries: int = 0
+    cache_hit: bool = False
+    # Shared the result of an identical call already in flight
+    coalesced: bool = False
+    # Served by the route's fallback model
+    fallback: bool = False
+    # A duplicate request was sent because the first was slow
+    hedged: bool = False
+    # The response failed validation, and whether local repair fixed it
+    invalid: bool = False
+    repaired: bool = False
+
+
+class OpUsage(BaseModel):
+    calls: int = 0
+    api_calls: int = 0
+    cache_hits: int = 0
+    coalesced: int = 0
+    retries: int = 0
+    fallbacks: int = 0
+    hedges: int = 0
+    invalid_responses: int = 0
+    repairs: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    wall_time: float = 0.0
+    queued: float = 0.0
+
+    def add(self, other: "OpUsage"):
+        for field in OpUsage.model_fields:
+            setattr(self, field, getattr(self, field) + getattr(other, field))
+
+
+class RoundUsage(BaseModel):
+    by_op: dict[str, OpUsage] = {}
+
+    @property
+    def total(self) -> OpUsage:
+        total = OpUsage()
+        for usage in self.by_op.values():
+            total.add(usage)
+        return total
+
+    def add(self, op: str, usage: OpUsage):
+        self.by_op.setdefault(op, OpUsage()).add(usage)
+
+
+def _observe(buckets: list[int], seconds: float):
+    # Cumulative buckets, as Prometheus histograms are
+    for i in range(bisect.bisect_left(LATENCY_BUCKETS, seconds), len(buckets)):
+        buckets[i] += 1
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._ops: dict[str, OpUsage] = {}
+        self._latency: dict[str, list[int]] = {}
+        # Per-op latency of single API requests, without queueing or cache hits
+        self._request_latency: dict[str, list[int]] = {}
+        self._requests: dict[str, int] = {}
+        self._request_seconds: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def record(self, op: str, usage: OpUsage):
+        with self._lock:
+            self._ops.setdefault(op, OpUsage()).add(usage)
+            _observe(
+                self._latency.setdefault(op, [0] * len(LATENCY_BUCKETS)),
+                usage.wall_time,
+            )
+
+    def observe_request(self, op: str, seconds: float):
+        with self._lock:
+            _observe(
+                self._request_latency.setdefault(op, [0] * len(LATENCY_BUCKETS)),
+                seconds,
+            )
+            self._requests[op] = self._requests.get(op, 0) + 1
+            self._request_seconds[op] = self._request_seconds.get(op, 0.0) + seconds
+
+    def request_quantile(
+        self, op: str, q: float, min_samples: int = 20
+    ) -> Optional[float]:
+        """Estimated q-quantile of the op's request latency, interpolated
+        within histogram buckets like Prometheus' histogram_quantile. None
+        until the op has `min_samples` requests."""
+        with self._lock:
+            count = self._requests.get(op, 0)
+            buckets = list(self._request_latency.get(op, ()))
+        if count < min_samples:
+            return None
+        rank = q * count
+        lower, below = 0.0, 0
+        for bound, cumulative in zip(LATENCY_BUCKETS, buckets):
+            if cumulative >= rank:
+                return lower + (bound - lower) * (rank - below) / (cumulative - below)
+            lower, below = bound, cumulative
+        return LATENCY_BUCKETS[-1]
+
+    def snapshot(self) -> dict[str, OpUsage]:
+        with self._lock:
+            return {op: usage.model_copy() for op, usage in self._ops.items()}
+
+    def render_prometheus(self) -> str:
+        with self._lock:
+            ops = {op: usage.model_copy() for op, usage in self._ops.items()}
+            latency = {op: list(buckets) for op, buckets in self._latency.items()}
+            request_latency = {
+                op: list(buckets) for op, buckets in self._request_latency.items()
+            }
+            requests = dict(self._requests)
+            request_seconds = {
+                op: round(seconds, 6) for op, seconds in self._request_seconds.items()
+            }
+
+        lines = []
+
+        def metric(name: str, kind: str, help: str, values: list[tuple[str, float]]):
+            lines.append(f"# HELP prompter_{name} {help}")
+            lines.append(f"# TYPE prompter_{name} {kind}")
+            lines.extend(
+                f"prompter_{name}{{{labels}}} {value}" for labels, value in values
+            )
+
+        metric(
+            "op_calls_total",
+            "counter",
+            "Op invocations",
+            [(f'op="{op}"', u.calls) for op, u in ops.items()],
+        )
+        metric(
+            "op_api_calls_total",
+            "counter",
+            "API requests made by op",
+            [(f'op="{op}"', u.api_calls) for op, u in ops.items()],
+        )
+        metric(
+            "op_cache_hits_total",
+            "counter",
+            "Responses served from cache",
+            [(f'op="{op}"', u.cache_hits) for op, u in ops.items()],
+        )
+        metric(
+            "op_coalesced_total",
+            "counter",
+            "Calls that shared an identical in-flight request",
+            [(f'op="{op}"', u.coalesced) for op, u in ops.items()],
+        )
+        metric(
+            "op_retries_total",
+            "counter",
+            "API request retries",
+            [(f'op="{op}"', u.retries) for op, u in ops.items()],
+        )
+        metric(
+            "op_fallbacks_total",
+            "counter",
+            "Requests served by a fallback model",
+            [(f'op="{op}"', u.fallbacks) for op, u in ops.items()],
+        )
+        metric(
+            "op_hedges_total",
+            "counter",
+            "Duplicate requests sent for slow requests",
+            [(f'op="{op}"', u.hedges) for op, u in ops.items()],
+        )
+        metric(
+            "op_invalid_responses_total",
+            "counter",
+            "Responses that failed schema validation",
+            [(f'op="{op}"', u.invalid_responses) for op, u in ops.items()],
+        )
+        metric(
+            "op_repairs_total",
+            "counter",
+            "Invalid responses fixed locally instead of requested again",
+            [(f'op="{op}"', u.repairs) for op, u in ops.items()],
+        )
+        metric(
+            "op_tokens_total",
+            "counter",
+            "Tokens used",
+            [(f'op="{op}",kind="prompt"', u.prompt_tokens) for op, u in ops.items()]
+            + [
+                (f'op="{op}",kind="completion"', u.completion_tokens)
+                for op, u in ops.items()
+            ],
+        )
+        metric(
+            "op_queued_seconds_total",
+            "counter",
+            "Time waiting for rate limits",
+            [(f'op="{op}"', round(u.queued, 6)) for op, u in ops.items()],
+        )
+
+        def histogram(name: str, help: str, values: dict, counts: dict, sums: dict):
+            lines.append(f"# HELP prompter_{name} {help}")
+            lines.append(f"# TYPE prompter_{name} histogram")
+            for op, buckets in values.items():
+                for bound, count in zip(LATENCY_BUCKETS, buckets):
+                    lines.append(
+                        f'prompter_{name}_bucket{{op="{op}",le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f'prompter_{name}_bucket{{op="{op}",le="+Inf"}} {counts[op]}'
+                )
+                lines.append(f'prompter_{name}_sum{{op="{op}"}} {sums[op]}')
+                lines.append(f'prompter_{name}_count{{op="{op}"}} {counts[op]}')
+
+        histogram(
+            "op_seconds",
+            "Op wall time",
+            latency,
+            {op: u.calls for op, u in ops.items()},
+            {op: round(u.wall_time, 6) for op, u in ops.items()},
+        )
+        histogram(
+            "request_seconds",
+            "API request time, excluding queueing and cache hits",
+            request_latency,
+            requests,
+            request_seconds,
+        )
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+_op_calls: contextvars.ContextVar[Optional[list[CallMetrics]]] = contextvars.ContextVar(
+    "op_calls", default=None
+)
+_op_name: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "op_name", default=None
+)
+_round_usage: contextvars.ContextVar[Optional[RoundUsage]] = contextvars.ContextVar(
+    "round_usage", default=None
+)
+_round_lock = threading.Lock()
+
+
+def record_call(call: CallMetrics):
+    """Attribute an API call or cache hit to the innermost instrumented op."""
+    calls = _op_calls.get()
+    if calls is not None:
+        calls.append(call)
+
+
+def current_op() -> Optional[str]:
+    """Name of the innermost instrumented op running in this context."""
+    return _op_name.get()
+
+
+def instrumented(fn: Callable) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        calls: list[CallMetrics] = []
+        token = _op_calls.set(calls)
+        name_token = _op_name.set(fn.__name__)
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _op_name.reset(name_token)
+            _op_calls.reset(token)
+            usage = OpUsage(
+                calls=1,
+                api_calls=sum(not (c.cache_hit or c.coalesced) for c in calls),
+                cache_hits=sum(c.cache_hit for c in calls),
+                coalesced=sum(c.coalesced for c in calls),
+                retries=sum(c.retries for c in calls),
+                fallbacks=sum(c.fallback for c in calls),
+                hedges=sum(c.hedged for c in calls),
+                invalid_responses=sum(c.invalid for c in calls),
+                repairs=sum(c.repaired for c in calls),
+                prompt_tokens=sum(c.prompt_tokens for c in calls),
+                completion_tokens=sum(c.completion_tokens for c in calls),
+                wall_time=time.perf_counter() - started,
+                queued=sum(c.queued for c in calls),
+            )
+            registry.record(fn.__name__, usage)
+
+            round_usage = _round_usage.get()
+            if round_usage is not None:
+                with _round_lock:
+                    round_usage.add(fn.__name__, usage)
+
+            # Attributes are fixed when a weave call starts, so the measured
+            # values go in the call summary instead
+            call = weave.get_current_call()
+            if call is not None:
+                if call.summary is None:
+                    call.summary = {}
+                call.summary["prompter"] = usage.model_dump()
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def collect_round() -> Iterator[RoundUsage]:
+    """Sum the usage of every instrumented op run inside the block, including
+    ops run from weave.ThreadPoolExecutor workers."""
+    usage = RoundUsage()
+    token = _round_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _round_usage.reset(token)
+
+
+def write_metrics(path: str):
+    with open(path, "w") as f:
+        f.write(registry.render_prometheus())
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """Serve the registry at http://host:port/metrics on a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = registry.render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
@@ -0,0 +1,367 @@
+"""Local stand-in for the OpenAI chat completions API.
+
+Serves deterministic canned responses shaped like PromptAnalysis,
+OptimizedPrompt and OutputScore (picked from the request's system
+instruction), or plain text for output generation, after a configurable
+simulated latency. Supports stream=True and can inject 429s.
+
+    python mock_server.py --port 8011 --latency 0.5
+    OPENAI_BASE_URL=http://127.0.0.1:8011/v1 OPENAI_API_KEY=mock python exp.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Optional
+
+MOCK_OUTPUT = (
+    "Forsooth, I journey to the market for eggs, though coin grows dear. "
+    "Two eggs suffice not; a hundred I require, and so small omelettes "
+    "shall break my fast."
+)
+
+
+def _analysis(request: dict) -> dict:
+    return {
+        "program_key": "style_transfer",
+        "program_inputs": ["poem text"],
+        "hallucination_risk": "low",
+        "hallucination_targets": ["archaic vocabulary"],
+        "program_improvement_ideas": ["specify meter", "keep the original meaning"],
+        "reasoning": "mock analysis",
+    }
+
+
+def _optimized(request: dict) -> dict:
+    return {
+        "original_prompt": "mock original prompt",
+        "optimized_prompt": (
+            "Rewrite the poem in Shakespearean English, in iambic pentameter, "
+            "keeping its meaning and humor."
+        ),
+        "improvements": ["specified meter", "preserved meaning"],
+    }
+
+
+def _score(request: dict) -> dict:
+    return {
+        "input_1": 62,
+        "input_2": 81,
+        "comparison_notes": ["input_2 follows the requested style more closely"],
+        "winner": "input_2",
+    }
+
+
+def _ranking(request: dict) -> dict:
+    outputs = len(
+        re.findall(r"^Output \d+:$", request["messages"][-1]["content"], re.MULTILINE)
+    )
+    return {
+        "scores": [60 + 5 * i for i in range(outputs)],
+        "winner": outputs,
+        "comparison_notes": ["later outputs follow the requested style more closely"],
+    }
+
+
+def _batch_scores(request: dict) -> dict:
+    items = len(
+        re.findall(
+            r"^Comparison \d+:$", request["messages"][-1]["content"], re.MULTILINE
+        )
+    )
+    return {"scores": [{"item": i, **_score(request)} for i in range(1, items + 1)]}
+
+
+def _fused(request: dict) -> dict:
+    return {"analysis": _analysis(request), "optimized": _optimized(request)}
+
+
+def _defect(body: dict) -> str:
+    """`body` as JSON with one defect a real model produces, chosen by its
+    content so repeated requests get the same one."""
+    lists = [k for k, v in body.items() if isinstance(v, list) and v]
+    scores = [k for k in ("input_1", "input_2") if k in body]
+    kind = len(json.dumps(body)) % 4
+    if kind == 1 and lists:
+        body = {**body, lists[0]: "\n".join(f"- {v}" for v in body[lists[0]])}
+    elif kind == 2 and lists:
+        body = {k: v for k, v in body.items() if k != lists[-1]}
+    elif kind == 3 and scores:
+        body = {**body, scores[0]: 150}
+    return f"```json\n{json.dumps(body)}\n```"
+
+
+# (marker in the system instruction, response builder), first match wins.
+# Requests without a matching marker get MOCK_OUTPUT as plain text.
+RESPONDERS: list[tuple[str, Callable[[dict], dict]]] = [
+    ("Return both the analysis and the optimized prompt", _fused),
+    ("Use this information to analyze the prompt", _analysis),
+    ("You previously analyzed a prompt", _analysis),
+    ("You are a prompt optimization expert", _optimized),
+    ("You are an expert prompt output evaluator", _score),
+    ("You are an expert judge ranking", _ranking),
+    ("You are an expert evaluator judging", _batch_scores),
+]
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class MockLLMServer:
+    """Threaded mock server; use as a context manager or start()/stop().
+
+    Each request sleeps `latency` seconds plus up to `jitter` seconds, drawn
+    from a generator seeded by the request body so runs are repeatable.
+    `error_rate` is the fraction of requests answered with a 429.
+    `model_latency` overrides `latency` for specific model names.
+    `token_delay` is added per word of the response, streamed or not, and
+    `prompt_delay` per prompt token. Prompts over `max_context_tokens` are
+    rejected with a 400, as a real model's context limit would.
+    `defect_rate` is the fraction of JSON responses given a common defect:
+    markdown fences, a list sent as a string, a missing list field or an
+    out-of-range score.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        token_delay: float = 0.0,
+        error_rate: float = 0.0,
+        model_latency: Optional[dict[str, float]] = None,
+        seed: int = 0,
+        prompt_delay: float = 0.0,
+        max_context_tokens: Optional[int] = None,
+        defect_rate: float = 0.0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.model_latency = model_latency or {}
+        self.seed = seed
+        self.prompt_delay = prompt_delay
+        self.max_context_tokens = max_context_tokens
+        self.defect_rate = defect_rate
+        self.requests = 0
+        self._errors = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="mock-llm", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def respond(self, request: dict) -> str:
+        system = " ".join(
+            m["content"] for m in request["messages"] if m["role"] == "system"
+        )
+        for marker, build in RESPONDERS:
+            if marker in system:
+                body = build(request)
+                with self._lock:
+                    defective = self._errors.random() < self.defect_rate
+                return _defect(body) if defective else json.dumps(body)
+        return MOCK_OUTPUT
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(
+                self, status: int, body: dict, headers: Optional[dict] = None
+            ):
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                raw = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                request = json.loads(raw)
+                response_format = request.get("response_format") or {}
+                if response_format.get("type") == "json_schema" and not (
+                    response_format.get("json_schema") or {}
+                ).get("schema"):
+                    self._send_json(
+                        400,
+                        {"error": {"message": "json_schema.schema is required"}},
+                    )
+                    return
+                with server._lock:
+                    server.requests += 1
+                    count = server.requests
+                    fail = server._errors.random() < server.error_rate
+
+                if fail:
+                    self._send_json(
+                        429,
+                        {"error": {"message": "mock rate limit", "type": "requests"}},
+                        {"retry-after-ms": "50"},
+                    )
+                    return
+
+                prompt_tokens = sum(
+                    _approx_tokens(m["content"]) for m in request["messages"]
+                )
+                if (
+                    server.max_context_tokens is not None
+                    and prompt_tokens > server.max_context_tokens
+                ):
+                    self._send_json(
+                        400,
+                        {
+                            "error": {
+                                "message": f"{prompt_tokens} prompt tokens exceed "
+                                f"the {server.max_context_tokens} token context",
+                                "code": "context_length_exceeded",
+                            }
+                        },
+                    )
+                    return
+
+                # Jitter depends only on the request, so reruns are identical
+                digest = hashlib.sha256(raw).hexdigest()
+                rng = random.Random(f"{server.seed}:{digest}")
+                latency = server.model_latency.get(request["model"], server.latency)
+                time.sleep(
+                    latency
+                    + rng.uniform(0, server.jitter)
+                    + server.prompt_delay * prompt_tokens
+                )
+
+                content = server.respond(request)
+                if not request.get("stream"):
+                    # Longer completions take longer, as streamed ones do
+                    time.sleep(server.token_delay * len(content.split(" ")))
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": _approx_tokens(content),
+                    "total_tokens": prompt_tokens + _approx_tokens(content),
+                }
+                if request.get("stream"):
+                    self._stream(request, content, usage)
+                    return
+                self._send_json(
+                    200,
+                    {
+                        "id": f"chatcmpl-mock-{count}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": request["model"],
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": content},
+                                "finish_reason": "stop",
+                            }
+                        ],
+                        "usage": usage,
+                    },
+                )
+
+            def _stream(self, request: dict, content: str, usage: dict):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+
+                def chunk(delta: dict, finish_reason=None, usage=None) -> bytes:
+                    body = {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": request["model"],
+                        "choices": [
+                            {
+                                "index": 0,
+                                "delta": delta,
+                                "finish_reason": finish_reason,
+                            }
+                        ]
+                        if usage is None
+                        else [],
+                        "usage": usage,
+                    }
+                    return f"data: {json.dumps(body)}\n\n".encode()
+
+                for word in content.split(" "):
+                    self.wfile.write(chunk({"content": word + " "}))
+                    self.wfile.flush()
+                    time.sleep(server.token_delay)
+                self.wfile.write(chunk({}, finish_reason="stop"))
+                if (request.get("stream_options") or {}).get("include_usage"):
+                    self.wfile.write(chunk({}, usage=usage))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockLLMServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        token_delay=args.token_delay,
+        error_rate=args.error_rate,
+    )
+    print(f"Mock OpenAI server on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from typing import Any, Callable, Optional
+
+import weave
+from pydantic import BaseModel
+
+
+class Stage:
+    """A named unit of work in a pipeline.
+
+    `fn` is called with the results of `deps` as keyword arguments, so a stage
+    that depends on "analyze" receives `analyze=<result>`. A stage still
+    running `timeout` seconds after it started is given up on.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        deps: tuple[str, ...] = (),
+        timeout: Optional[float] = None,
+    ):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = timeout
+
+
+class StageTiming(BaseModel):
+    # Offsets in seconds from the start of the pipeline
+    started_at: float
+    finished_at: float
+
+    @property
+    def duration(self) -> float:
+        return self.finished_at - self.started_at
+
+
+class PipelineTimings(BaseModel):
+    stages: dict[str, StageTiming]
+    wall_time: float
+    critical_path: list[str]
+    critical_path_time: float
+    # Stages given up on at their timeout or the pipeline deadline, and
+    # stages never started because a dependency was given up on
+    timed_out: list[str] = []
+    skipped: list[str] = []
+
+    @property
+    def sequential_time(self) -> float:
+        """Time the same stages would have taken run one after another."""
+        return sum(timing.duration for timing in self.stages.values())
+
+    @property
+    def saved_time(self) -> float:
+        return self.sequential_time - self.wall_time
+
+    def report(self) -> str:
+        lines = [
+            f"{name}: {timing.duration:.2f}s (started +{timing.started_at:.2f}s)"
+            for name, timing in self.stages.items()
+        ]
+        lines.append(
+            f"critical path ({' -> '.join(self.critical_path)}): "
+            f"{self.critical_path_time:.2f}s"
+        )
+        lines.append(
+            f"wall time: {self.wall_time:.2f}s, "
+            f"sequential: {self.sequential_time:.2f}s, "
+            f"saved: {self.saved_time:.2f}s"
+        )
+        if self.timed_out:
+            lines.append(
+                f"timed out: {', '.join(self.timed_out)}"
+                + (f", skipped: {', '.join(self.skipped)}" if self.skipped else "")
+            )
+        return "\n".join(lines)
+
+
+def _critical_path(
+    stages: dict[str, Stage], timings: dict[str, StageTiming]
+) -> tuple[list[str], float]:
+    # Longest chain of stage durations through the dependency graph, over the
+    # stages that ran
+    longest: dict[str, tuple[float, Optional[str]]] = {}
+
+    def visit(name: str) -> float:
+        if name not in longest:
+            deps = [dep for dep in stages[name].deps if dep in timings]
+            parent = max(deps, key=visit, default=None)
+            base = visit(parent) if parent else 0.0
+            longest[name] = (base + timings[name].duration, parent)
+        return longest[name][0]
+
+    end = max(timings, key=visit)
+    path = []
+    node: Optional[str] = end
+    while node:
+        path.append(node)
+        node = longest[node][1]
+    return list(reversed(path)), longest[end][0]
+
+
+def run_pipeline(
+    stages: list[Stage],
+    max_workers: Optional[int] = None,
+    deadline: Optional[float] = None,
+) -> tuple[dict[str, Any], PipelineTimings]:
+    """Run stages as soon as their dependencies finish.
+
+    Returns the result of every stage keyed by name, plus per-stage timings.
+    Any stage error is re-raised once in-flight stages have finished.
+
+    Stages past their own timeout, or still running `deadline` seconds after
+    the pipeline started, are abandoned without waiting for them: they and
+    the stages depending on them are missing from the results and listed in
+    the timings' `timed_out` and `skipped`.
+    """
+    by_name = {stage.name: stage for stage in stages}
+    for stage in stages:
+        missing = [dep for dep in stage.deps if dep not in by_name]
+        if missing:
+            raise ValueError(f"Stage {stage.name!r} depends on unknown {missing}")
+
+    pending = dict(by_name)
+    results: dict[str, Any] = {}
+    timings: dict[str, StageTiming] = {}
+    timed_out: list[str] = []
+    start = time.perf_counter()
+
+    def run_stage(stage: Stage) -> Any:
+        started = time.perf_counter() - start
+        result = stage.fn(**{dep: results[dep] for dep in stage.deps})
+        # An abandoned stage keeps the timing it was given up with
+        timings.setdefault(
+            stage.name,
+            StageTiming(started_at=started, finished_at=time.perf_counter() - start),
+        )
+        return result
+
+    def expires_at(name: str, submitted: float) -> float:
+        limits = [float("inf")]
+        if by_name[name].timeout is not None:
+            limits.append(submitted + by_name[name].timeout)
+        if deadline is not None:
+            limits.append(deadline)
+        return min(limits)
+
+    executor = weave.ThreadPoolExecutor(max_workers=max_workers or len(stages))
+    try:
+        # future -> (stage name, offset it was submitted at)
+        running: dict[Any, tuple[str, float]] = {}
+        while pending or running:
+            for name, stage in list(pending.items()):
+                if any(dep in timed_out for dep in stage.deps):
+                    del pending[name]
+                elif all(dep in results for dep in stage.deps):
+                    del pending[name]
+                    future = executor.submit(run_stage, stage)
+                    running[future] = (name, time.perf_counter() - start)
+            if not running:
+                if pending and not timed_out:
+                    raise ValueError(f"Dependency cycle between stages {list(pending)}")
+                break
+
+            next_expiry = min(expires_at(*entry) for entry in running.values())
+            done, _ = wait(
+                running,
+                timeout=max(0.0, next_expiry - (time.perf_counter() - start))
+                if next_expiry != float("inf")
+                else None,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                name, _ = running.pop(future)
+                results[name] = future.result()
+
+            now = time.perf_counter() - start
+            for future, (name, submitted) in list(running.items()):
+                if now >= expires_at(name, submitted):
+                    del running[future]
+                    timed_out.append(name)
+                    timings.setdefault(
+                        name, StageTiming(started_at=submitted, finished_at=now)
+                    )
+    finally:
+        # Abandoned stages finish in the background
+        executor.shutdown(wait=not timed_out, cancel_futures=True)
+
+    skipped = [name for name in by_name if name not in timings]
+    critical_path, critical_path_time = _critical_path(by_name, timings)
+    return results, PipelineTimings(
+        stages={name: timings[name] for name in by_name if name in timings},
+        wall_time=time.perf_counter() - start,
+        critical_path=critical_path,
+        critical_path_time=critical_path_time,
+        timed_out=timed_out,
+        skipped=skipped,
+    )
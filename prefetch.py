@@ -0,0 +1,143 @@
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import CancelledError, Future
+from typing import Optional
+
+import weave
+from pydantic import BaseModel
+
+from exp import (
+    OptimizedPrompt,
+    PromptAnalysis,
+    analyze_prompt,
+    analyze_prompt_delta,
+    optimize_prompt,
+)
+from incremental import PriorRound, plan
+from scheduler import track_calls
+
+
+class PrefetchResult(BaseModel):
+    analysis: PromptAnalysis
+    optimized: OptimizedPrompt
+    # How the prompt was analyzed, as incremental.plan() picked it
+    mode: str = "full"
+    analyze_seconds: float = 0.0
+    analyze_tokens: int = 0
+    optimize_seconds: float = 0.0
+    optimize_tokens: int = 0
+
+
+def _tokens(calls) -> int:
+    return sum(c.actual_tokens or c.estimated_tokens for c in calls)
+
+
+class Prefetcher:
+    """Speculatively runs the analyze and optimize stages for likely next prompts.
+
+    Meant to live in one player's session: while they read and rate, call
+    prefetch() with the prompts they are likely to submit next, and
+    generate_responses picks the results up with get(). Prompts dropped from
+    the candidate list are cancelled, either before they start or between
+    the analyze and optimize calls.
+
+    Prompts are analyzed as generate_responses would given the session's
+    previous round: an edit of its prompt gets a delta analysis, and its
+    unchanged prompt is not prefetched at all.
+    """
+
+    def __init__(self, max_workers: int = 1):
+        self._executor = weave.ThreadPoolExecutor(max_workers=max_workers)
+        self._futures: dict[str, tuple[Future, threading.Event]] = {}
+        self._previous: Optional[PriorRound] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, prompts: Iterable[str], previous: Optional[PriorRound] = None):
+        """Precompute `prompts`, cancelling any other pending prefetches.
+
+        `previous` is the session's last round, as passed to generate_responses.
+        """
+        wanted = [
+            prompt
+            for prompt in dict.fromkeys(prompts)
+            if prompt and plan(prompt, previous)[0] != "reused"
+        ]
+        with self._lock:
+            # Results planned against another round would misreport savings
+            stale = previous != self._previous
+            self._previous = previous
+            for prompt in list(self._futures):
+                if stale or prompt not in wanted:
+                    future, cancelled = self._futures.pop(prompt)
+                    cancelled.set()
+                    future.cancel()
+            for prompt in wanted:
+                if prompt not in self._futures:
+                    cancelled = threading.Event()
+                    future = self._executor.submit(
+                        self._compute, prompt, previous, cancelled
+                    )
+                    self._futures[prompt] = (future, cancelled)
+
+    @staticmethod
+    def _compute(
+        prompt: str, previous: Optional[PriorRound], cancelled: threading.Event
+    ) -> PrefetchResult:
+        mode, _ = plan(prompt, previous)
+        started = time.perf_counter()
+        with track_calls() as analyze_calls:
+            if mode == "delta":
+                analysis = analyze_prompt_delta(
+                    previous.analysis, previous.prompt, prompt
+                )
+            else:
+                analysis = analyze_prompt(prompt, is_system_prompt=True)
+        analyzed = time.perf_counter()
+        if cancelled.is_set():
+            raise CancelledError()
+        with track_calls() as optimize_calls:
+            optimized = optimize_prompt(analysis, prompt)
+        return PrefetchResult(
+            analysis=analysis,
+            optimized=optimized,
+            mode=mode,
+            analyze_seconds=analyzed - started,
+            analyze_tokens=_tokens(analyze_calls),
+            optimize_seconds=time.perf_counter() - analyzed,
+            optimize_tokens=_tokens(optimize_calls),
+        )
+
+    def get(
+        self, prompt: str, previous: Optional[PriorRound] = None
+    ) -> Optional[PrefetchResult]:
+        """The prefetched result for `prompt`, waiting if it is already running.
+
+        Returns None when `prompt` was never prefetched, its prefetch failed,
+        or it is still queued behind other prefetches (it is then cancelled),
+        in which case the caller should compute it itself. So is a prefetch
+        planned against a different previous round.
+        """
+        with self._lock:
+            entry = self._futures.get(prompt) if previous == self._previous else None
+            # cancel() only succeeds for a prefetch that hasn't started
+            if entry is not None and entry[0].cancel():
+                entry[1].set()
+                del self._futures[prompt]
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        try:
+            result = entry[0].result()
+        except Exception:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def shutdown(self):
+        self.prefetch([])
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,98 @@
+"""Which model serves each LLM op.
+
+A RoutingPolicy maps op names to a ModelRoute, falling back to its default
+route. The active policy is `exp.routing`, picked by PROMPTER_ROUTING from
+POLICIES (default "single").
+"""
+
+import os
+from typing import Optional
+
+from pydantic import BaseModel
+
+MODEL = os.environ.get("PROMPTER_MODEL", "gpt-4o")
+FAST_MODEL = os.environ.get("PROMPTER_FAST_MODEL", "gpt-4o-mini")
+# Seconds before a fast-model call gives up and falls back to MODEL
+FAST_TIMEOUT = float(os.environ.get("PROMPTER_FAST_TIMEOUT", "20"))
+
+# Structured ops a smaller model handles well
+ANALYSIS_OPS = (
+    "analyze_prompt",
+    "analyze_prompt_chunk",
+    "analyze_prompt_delta",
+    "analyze_and_optimize",
+    "optimize_prompt",
+)
+JUDGE_OPS = ("score_outputs", "score_outputs_packed", "rank_outputs")
+
+
+class ModelRoute(BaseModel):
+    model: str
+    # Tried when `model` times out, or fails after its retries
+    fallback: Optional[str] = None
+    # Request timeout in seconds for `model`
+    timeout: Optional[float] = None
+    # Larger prompts skip `model` and go straight to the fallback
+    max_prompt_tokens: Optional[int] = None
+
+    def attempts(self, prompt_tokens: int) -> list[tuple[str, Optional[float]]]:
+        """(model, timeout) pairs to try in order for a prompt of this size"""
+        if self.fallback is None:
+            return [(self.model, self.timeout)]
+        if (
+            self.max_prompt_tokens is not None
+            and prompt_tokens > self.max_prompt_tokens
+        ):
+            return [(self.fallback, None)]
+        return [(self.model, self.timeout), (self.fallback, None)]
+
+
+class RoutingPolicy(BaseModel):
+    name: str
+    default: ModelRoute = ModelRoute(model=MODEL)
+    # Routes for specific ops, by op name
+    ops: dict[str, ModelRoute] = {}
+
+    def route(self, op: Optional[str]) -> ModelRoute:
+        return self.ops.get(op, self.default) if op else self.default
+
+
+def _for_ops(ops: tuple[str, ...], route: ModelRoute) -> dict[str, ModelRoute]:
+    return {op: route for op in ops}
+
+
+POLICIES = {
+    # Everything on the strong model
+    "single": RoutingPolicy(name="single"),
+    # Analysis and optimization on the fast model, outputs and judging on the
+    # strong one; a slow fast-model call is retried on the strong model
+    "static": RoutingPolicy(
+        name="static",
+        ops=_for_ops(
+            ANALYSIS_OPS,
+            ModelRoute(model=FAST_MODEL, fallback=MODEL, timeout=FAST_TIMEOUT),
+        ),
+    ),
+    # As "static", but long prompts, where the fast model's analysis is
+    # weakest, go to the strong model
+    "size": RoutingPolicy(
+        name="size",
+        ops=_for_ops(
+            ANALYSIS_OPS,
+            ModelRoute(
+                model=FAST_MODEL,
+                fallback=MODEL,
+                timeout=FAST_TIMEOUT,
+                max_prompt_tokens=2000,
+            ),
+        ),
+    ),
+    # Also judge on the fast model
+    "fast": RoutingPolicy(
+        name="fast",
+        ops=_for_ops(
+            ANALYSIS_OPS + JUDGE_OPS,
+            ModelRoute(model=FAST_MODEL, fallback=MODEL, timeout=FAST_TIMEOUT),
+        ),
+    ),
+}
@@ -0,0 +1,355 @@
+import contextlib
+import contextvars
+import random
+import threading
+import time
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional, TypeVar
+
+import openai
+from pydantic import BaseModel
+
+from sizing import count_tokens
+
+T = TypeVar("T")
+
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+
+class CallTiming(BaseModel):
+    # Seconds waiting for admission or backing off between attempts
+    queued: float = 0.0
+    # Seconds spent inside API requests, summed over attempts
+    in_flight: float = 0.0
+    attempts: int = 0
+    rate_limited: int = 0
+    estimated_tokens: int = 0
+    actual_tokens: Optional[int] = None
+    # A duplicate request was sent because the first was slow
+    hedged: bool = False
+
+
+class SchedulerStats(BaseModel):
+    requests: int = 0
+    retries: int = 0
+    rate_limited: int = 0
+    failures: int = 0
+    hedges: int = 0
+    queued_time: float = 0.0
+    in_flight_time: float = 0.0
+    requests_per_minute: float = 0.0
+    tokens_per_minute: float = 0.0
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate_per_minute`.
+
+    Admission is by reservation: a caller takes its tokens immediately, possibly
+    driving the bucket negative, and is told how long to wait for the debt to be
+    repaid. This keeps admission first-come first-served under contention.
+    The effective rate is adaptive: halved on rate-limit errors and recovered
+    gradually on success, never above the configured limit.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.limit = rate_per_minute
+        self.rate = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.rate, self.tokens + (now - self.updated) * self.rate / 60
+        )
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Take `amount` tokens and return the seconds to wait before using them."""
+        with self.lock:
+            self._refill()
+            self.tokens -= min(amount, self.rate)
+            return max(0.0, -self.tokens * 60 / self.rate)
+
+    def try_take(self, amount: float) -> bool:
+        """Take `amount` tokens only if they are available without waiting."""
+        with self.lock:
+            self._refill()
+            if self.tokens < min(amount, self.rate):
+                return False
+            self.tokens -= min(amount, self.rate)
+            return True
+
+    def adjust(self, delta: float):
+        """Charge (positive) or refund (negative) tokens after the fact."""
+        with self.lock:
+            self.tokens -= delta
+
+    def throttle(self):
+        with self.lock:
+            self.rate = max(self.limit * 0.1, self.rate / 2)
+
+    def recover(self):
+        with self.lock:
+            self.rate = min(self.limit, self.rate + self.limit * 0.05)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """Seconds the server asked us to wait, from retry-after(-ms) headers."""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    if headers.get("retry-after-ms"):
+        try:
+            return float(headers["retry-after-ms"]) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+_tracked_timings: contextvars.ContextVar[Optional[list[CallTiming]]] = (
+    contextvars.ContextVar("tracked_timings", default=None)
+)
+
+
+@contextlib.contextmanager
+def track_calls() -> Iterator[list[CallTiming]]:
+    """Collect the CallTiming of every scheduled call made inside the block,
+    including calls made from weave.ThreadPoolExecutor workers."""
+    timings: list[CallTiming] = []
+    token = _tracked_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _tracked_timings.reset(token)
+
+
+class Scheduler:
+    """Admission control and retries shared by every LLM call.
+
+    Requests wait for both the requests-per-minute and tokens-per-minute
+    budgets and for one of `max_in_flight` request slots, and retryable errors
+    are retried with jittered exponential backoff, honoring the server's
+    retry-after when given. A streamed call can keep its slot while the
+    stream is read with `hold_slot`, so long streams count toward
+    `max_in_flight` too.
+
+    A call given `hedge_after` that is still in flight that many seconds after
+    admission gets a duplicate, and the first success wins. The duplicate
+    needs a free slot and budget right away, so nothing is hedged while
+    other calls are queueing.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 500,
+        tokens_per_minute: float = 30_000,
+        max_retries: int = 5,
+        base_delay: float = 0.5,
+        max_delay: float = 30.0,
+        max_in_flight: int = 64,
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._stats = SchedulerStats()
+        self._lock = threading.Lock()
+        # Calls waiting on the budgets or for a slot
+        self._waiting = 0
+        self._hedge_pool = ThreadPoolExecutor(
+            max_workers=2 * max_in_flight, thread_name_prefix="hedge"
+        )
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = retry_after(error)
+        if delay is None:
+            # Full jitter keeps retrying clients from synchronizing
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        return delay
+
+    def run(
+        self,
+        fn: Callable[[], T],
+        estimated_tokens: int,
+        count_tokens: Callable[[T], Optional[int]] = lambda result: None,
+        no_retry: tuple[type[Exception], ...] = (),
+        hedge_after: Optional[float] = None,
+        hold_slot: bool = False,
+    ) -> tuple[T, CallTiming]:
+        """Call `fn` once admitted, retrying retryable errors.
+
+        `count_tokens` reports the tokens the result actually used so the token
+        budget can be corrected for the estimate. Errors in `no_retry` are
+        raised at once, e.g. a timeout the caller handles with another model.
+        `hedge_after` is the in-flight time after which to send a duplicate.
+        With `hold_slot`, a successful call keeps its slot until the caller
+        calls release(); such calls are never hedged.
+        """
+        if hold_slot:
+            hedge_after = None
+        timing = CallTiming(estimated_tokens=estimated_tokens)
+        try:
+            while True:
+                with self._lock:
+                    self._waiting += 1
+                try:
+                    delay = max(
+                        self.requests.reserve(1),
+                        self.tokens.reserve(estimated_tokens),
+                    )
+                    timing.queued += delay
+                    time.sleep(delay)
+
+                    waiting = time.perf_counter()
+                    self._slots.acquire()
+                    timing.queued += time.perf_counter() - waiting
+                finally:
+                    with self._lock:
+                        self._waiting -= 1
+
+                timing.attempts += 1
+                started = time.perf_counter()
+                try:
+                    result, hedged = self._call(
+                        fn, hedge_after, estimated_tokens, hold_slot
+                    )
+                    timing.hedged = timing.hedged or hedged
+                except RETRYABLE_ERRORS as e:
+                    timing.in_flight += time.perf_counter() - started
+                    if isinstance(e, openai.RateLimitError):
+                        timing.rate_limited += 1
+                        self.requests.throttle()
+                        self.tokens.throttle()
+                    if timing.attempts > self.max_retries or isinstance(e, no_retry):
+                        raise
+                    delay = self._backoff(timing.attempts - 1, e)
+                    timing.queued += delay
+                    time.sleep(delay)
+                    continue
+                timing.in_flight += time.perf_counter() - started
+
+                self.requests.recover()
+                self.tokens.recover()
+                timing.actual_tokens = count_tokens(result)
+                if timing.actual_tokens is not None:
+                    self.tokens.adjust(timing.actual_tokens - estimated_tokens)
+                return result, timing
+        except Exception:
+            with self._lock:
+                self._stats.failures += 1
+            raise
+        finally:
+            self._record(timing)
+
+    def _call(
+        self,
+        fn: Callable[[], T],
+        hedge_after: Optional[float],
+        estimated_tokens: int,
+        hold_slot: bool = False,
+    ) -> tuple[T, bool]:
+        """Run `fn` in the slot just acquired; each request releases its own
+        slot when it returns, or only when it fails with `hold_slot`. Returns
+        the result and whether it was hedged."""
+
+        def in_slot() -> T:
+            try:
+                result = fn()
+            except BaseException:
+                self._slots.release()
+                raise
+            if not hold_slot:
+                self._slots.release()
+            return result
+
+        if hedge_after is None:
+            return in_slot(), False
+
+        first = self._hedge_pool.submit(contextvars.copy_context().run, in_slot)
+        done, _ = wait([first], timeout=hedge_after)
+        if done or not self._admit_hedge(estimated_tokens):
+            return first.result(), False
+
+        with self._lock:
+            self._stats.hedges += 1
+        # The slower request finishes in the background
+        running = {
+            first,
+            self._hedge_pool.submit(contextvars.copy_context().run, in_slot),
+        }
+        error: Optional[Exception] = None
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    return future.result(), True
+                except Exception as e:
+                    error = error or e
+        raise error
+
+    def release(self):
+        """Free the slot of a call run with `hold_slot`."""
+        self._slots.release()
+
+    def _admit_hedge(self, estimated_tokens: int) -> bool:
+        """Take a slot and budget for a duplicate request, only if no call is
+        queueing and they are free right now."""
+        with self._lock:
+            if self._waiting:
+                return False
+        if not self._slots.acquire(blocking=False):
+            return False
+        if not self.requests.try_take(1):
+            self._slots.release()
+            return False
+        if not self.tokens.try_take(estimated_tokens):
+            self.requests.adjust(-1)
+            self._slots.release()
+            return False
+        return True
+
+    def _record(self, timing: CallTiming):
+        with self._lock:
+            self._stats.requests += 1
+            self._stats.retries += max(0, timing.attempts - 1)
+            self._stats.rate_limited += timing.rate_limited
+            self._stats.queued_time += timing.queued
+            self._stats.in_flight_time += timing.in_flight
+        tracked = _tracked_timings.get()
+        if tracked is not None:
+            tracked.append(timing)
+
+    def stats(self) -> SchedulerStats:
+        with self._lock:
+            stats = self._stats.model_copy()
+        stats.requests_per_minute = self.requests.rate
+        stats.tokens_per_minute = self.tokens.rate
+        return stats
+
+
+def estimate_tokens(messages: list[dict], completion_tokens: int = 500) -> int:
+    # Prompt tokens plus room for the completion
+    return sum(count_tokens(m["content"]) for m in messages) + completion_tokens
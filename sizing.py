@@ -0,0 +1,64 @@
+"""Token counting and size limits for prompts and outputs sent to the judge."""
+
+import functools
+from typing import Callable, Optional
+
+# Characters per token when tiktoken is not installed
+CHARS_PER_TOKEN = 4
+
+
+@functools.lru_cache(maxsize=1)
+def _encoder() -> Optional[Callable[[str], list]]:
+    try:
+        import tiktoken
+
+        # gpt-4o's encoding; fetched once and cached by tiktoken
+        return tiktoken.get_encoding("o200k_base").encode
+    except Exception:
+        # Not installed, or the encoding can't be downloaded
+        return None
+
+
+def count_tokens(text: str) -> int:
+    """Token count of `text`, exact with tiktoken or estimated without it."""
+    encode = _encoder()
+    if encode is not None:
+        return len(encode(text, disallowed_special=()))
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def split_text(text: str, max_tokens: int) -> list[str]:
+    """Split text into chunks of at most ~max_tokens, on line boundaries
+    where possible."""
+    chunks = []
+    current: list[str] = []
+    current_tokens = 0
+    for line in text.splitlines(keepends=True):
+        tokens = count_tokens(line)
+        if tokens > max_tokens:
+            # A single huge line is cut by characters
+            step = max_tokens * CHARS_PER_TOKEN
+            pieces = [line[i : i + step] for i in range(0, len(line), step)]
+        else:
+            pieces = [line]
+        for piece in pieces:
+            piece_tokens = tokens if len(pieces) == 1 else count_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("".join(current))
+    return chunks
+
+
+def truncate(text: str, max_tokens: int) -> str:
+    """Cut text to about max_tokens, keeping its start and end."""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    # Scale characters by the text's own chars/token ratio
+    keep = max(1, int(len(text) * max_tokens / tokens) // 2)
+    omitted = tokens - max_tokens
+    return f"{text[:keep]}\n[... ~{omitted} tokens omitted ...]\n{text[-keep:]}"
@@ -0,0 +1,135 @@
+"""JSON-schema response formats and local repair of structured responses.
+
+response_format() asks the API for JSON matching a pydantic model. When a
+response still fails validation, repair() fixes the common defects locally
+instead of paying for another request:
+- markdown fences or text around the JSON object
+- a string where a list is expected, or a list where a string is expected
+- list fields that are missing or null
+- numbers sent as strings, and numbers outside the field's ge/le bounds
+"""
+
+import json
+import re
+import types
+import typing
+from typing import Any, Optional
+
+from pydantic import BaseModel
+
+_FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+_BULLET = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s+")
+_NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+# `X | None` annotations, Python 3.10+
+_UNION_TYPES = (typing.Union, getattr(types, "UnionType", typing.Union))
+
+
+def response_format(model: type[BaseModel]) -> dict:
+    # Not strict: strict mode requires every field, including optional ones
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": model.__name__,
+            "schema": model.model_json_schema(),
+            "strict": False,
+        },
+    }
+
+
+def _unwrap(annotation: Any) -> tuple[Any, list]:
+    """The type under Optional[...] and Annotated[...], plus any constraints"""
+    metadata: list = []
+    while True:
+        origin = typing.get_origin(annotation)
+        args = typing.get_args(annotation)
+        if origin is typing.Annotated:
+            annotation = args[0]
+            for extra in args[1:]:
+                metadata.extend(getattr(extra, "metadata", [extra]))
+        elif origin in _UNION_TYPES:
+            non_null = [arg for arg in args if arg is not type(None)]
+            if len(non_null) != 1:
+                return annotation, metadata
+            annotation = non_null[0]
+        else:
+            return annotation, metadata
+
+
+def _clamp(value: float, metadata: list) -> float:
+    for constraint in metadata:
+        if getattr(constraint, "ge", None) is not None:
+            value = max(value, constraint.ge)
+        if getattr(constraint, "le", None) is not None:
+            value = min(value, constraint.le)
+    return value
+
+
+def _coerce(annotation: Any, value: Any, metadata: Optional[list] = None) -> Any:
+    annotation, extra = _unwrap(annotation)
+    metadata = (metadata or []) + extra
+    origin = typing.get_origin(annotation)
+
+    if origin is list:
+        (item_type,) = typing.get_args(annotation) or (Any,)
+        if value is None:
+            return []
+        if isinstance(value, str):
+            lines = [_BULLET.sub("", line).strip() for line in value.splitlines()]
+            value = [line for line in lines if line]
+        elif not isinstance(value, list):
+            value = [value]
+        return [_coerce(item_type, item) for item in value]
+
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return _coerce_fields(annotation, value) if isinstance(value, dict) else value
+
+    if annotation is str:
+        if isinstance(value, list):
+            return "\n".join(str(item) for item in value)
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return str(value)
+        return value
+
+    if annotation in (int, float):
+        if isinstance(value, str):
+            # e.g. "85" or "85/100"
+            match = _NUMBER.search(value)
+            if not match:
+                return value
+            value = float(match.group())
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = _clamp(value, metadata)
+            return round(value) if annotation is int else float(value)
+    return value
+
+
+def _coerce_fields(model: type[BaseModel], data: dict) -> dict:
+    repaired = dict(data)
+    for name, field in model.model_fields.items():
+        if name in repaired:
+            repaired[name] = _coerce(field.annotation, repaired[name], field.metadata)
+        elif typing.get_origin(_unwrap(field.annotation)[0]) is list:
+            repaired[name] = []
+    return repaired
+
+
+def repair(model: type[BaseModel], content: Optional[str]) -> str:
+    """Best-effort fix of a response that failed to validate as `model`.
+
+    Returns the repaired JSON, which may still fail validation. Raises
+    ValueError if no JSON object can be found at all, and TypeError if
+    `content` is None, as it is for a refusal.
+    """
+    if content is None:
+        raise TypeError("Response has no content to repair")
+    text = _FENCE.sub("", content.strip())
+    try:
+        data = json.loads(text)
+    except ValueError:
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            raise ValueError("No JSON object in response") from None
+        data = json.loads(text[start : end + 1])
+    if isinstance(data, dict):
+        return json.dumps(_coerce_fields(model, data))
+    raise ValueError("Response is not a JSON object")
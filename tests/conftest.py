@@ -0,0 +1,26 @@
+import os
+
+# Before exp is imported: no weave traces and an in-memory response cache
+os.environ["PROMPTER_TRACING"] = "off"
+os.environ["PROMPTER_CACHE_PATH"] = ""
+
+import pytest
+
+import exp
+from mock_server import MockLLMServer
+from scheduler import Scheduler
+
+
+@pytest.fixture
+def mock_llm(monkeypatch):
+    """A running MockLLMServer that exp's calls go to, with no response cache
+    and no rate limits. Tests can change its attributes, e.g. `latency`."""
+    with MockLLMServer(latency=0.01) as server:
+        exp.configure_client(base_url=server.base_url, api_key="mock")
+        monkeypatch.setattr(exp.response_cache, "enabled", False)
+        monkeypatch.setattr(
+            exp,
+            "scheduler",
+            Scheduler(requests_per_minute=1e9, tokens_per_minute=1e12, base_delay=0),
+        )
+        yield server
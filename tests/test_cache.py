@@ -0,0 +1,73 @@
+import threading
+import time
+
+import pytest
+
+from cache import ResponseCache, SingleFlight
+
+
+def test_response_cache_round_trip():
+    cache = ResponseCache(path=None)
+    key = ResponseCache.make_key("model", [{"role": "user", "content": "hi"}])
+    assert cache.get(key) is None
+    cache.set(key, "content")
+    assert cache.get(key) == "content"
+    cache.enabled = False
+    assert cache.get(key) is None
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+    calls = []
+    results = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return "result"
+
+    threads = [
+        threading.Thread(target=lambda: results.append(flight.do("key", slow)))
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False] + [True] * 4
+    assert {result for result, _ in results} == {"result"}
+    stats = flight.stats()
+    assert (stats.leaders, stats.coalesced, stats.in_flight) == (1, 4, 0)
+
+
+def test_single_flight_shares_errors_and_forgets_the_key():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flight.do("key", fail)
+    assert flight.do("key", lambda: 1) == (1, False)
+
+
+def test_single_flight_disabled_runs_every_call():
+    flight = SingleFlight()
+    flight.enabled = False
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.1)
+        return len(calls)
+
+    threads = [threading.Thread(target=flight.do, args=("key", slow)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 3
+    assert flight.stats().coalesced == 0
@@ -0,0 +1,92 @@
+import sqlite3
+
+import pytest
+
+from evalstore import EvalStore, PlayerEval
+from utils import AnalysisData
+
+
+def evaluation(round_id: str, program_key: str = "summarize", **scores) -> PlayerEval:
+    data = AnalysisData(
+        original_system_prompt="Summarize.",
+        optimized_system_prompt="Summarize in one sentence.",
+        user_prompt="text",
+        program_key=program_key,
+        program_inputs=[],
+        hallucination_risk="",
+        hallucination_targets=[],
+        program_improvement_ideas=[],
+        original_output="a",
+        optimized_output="b",
+        original_score=scores.get("judge_original"),
+        optimized_score=scores.get("judge_optimized"),
+    )
+    return PlayerEval(
+        round_id=round_id,
+        analysis_data=data,
+        player_original=scores.get("player_original", 5),
+        player_optimized=scores.get("player_optimized", 7),
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    return EvalStore(str(tmp_path / "evals.sqlite"), flush_interval=0.01)
+
+
+def test_leaderboard_totals(store):
+    store.record(evaluation("1", judge_original=40, judge_optimized=60))
+    store.record(evaluation("2", player_original=8, player_optimized=4))
+    store.record(evaluation("3", program_key="translate"))
+    # Recording a round twice is a no-op
+    store.record(evaluation("1", judge_original=40, judge_optimized=60))
+    assert store.flush()
+
+    top = store.leaderboard()
+    assert [stats.program_key for stats in top] == ["summarize", "translate"]
+    assert top[0].rounds == 2
+    assert top[0].player_optimized_win_rate == 0.5
+    assert top[0].judge_optimized_win_rate == 1.0
+    assert top[0].mean_player_delta == -1.0
+    assert top[0].mean_judge_delta == 20.0
+    assert store.overall().rounds == 3
+    assert store.rounds_since(0, "translate") == 1
+    assert len(store.leaderboard(limit=1)) == 1
+
+
+def test_failed_batch_is_dropped_and_the_writer_keeps_going(store, monkeypatch, capsys):
+    write = EvalStore._write
+
+    def failing_write(db, evaluation):
+        if evaluation.round_id == "bad":
+            raise sqlite3.IntegrityError("bad row")
+        write(db, evaluation)
+
+    monkeypatch.setattr(EvalStore, "_write", staticmethod(failing_write))
+    store.record(evaluation("bad"))
+    assert store.flush(timeout=5)
+    assert "Dropped 1 player evaluations" in capsys.readouterr().err
+
+    store.record(evaluation("good"))
+    assert store.flush(timeout=5)
+    assert store.overall().rounds == 1
+
+
+def test_locked_database_is_retried(store, monkeypatch):
+    write = EvalStore._write
+    failures = [sqlite3.OperationalError("database is locked")]
+
+    def flaky_write(db, evaluation):
+        if failures:
+            raise failures.pop()
+        write(db, evaluation)
+
+    monkeypatch.setattr(EvalStore, "_write", staticmethod(flaky_write))
+    store.record(evaluation("1"))
+    assert store.flush(timeout=5)
+    assert store.overall().rounds == 1
+
+
+def test_flush_times_out(store, monkeypatch):
+    monkeypatch.setattr(store._pending, "unfinished_tasks", 1)
+    assert not store.flush(timeout=0.05)
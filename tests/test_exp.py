@@ -0,0 +1,177 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+import exp
+from metrics import collect_round
+from routing import FAST_MODEL, POLICIES
+
+
+def test_generate_output_skips_cache(mock_llm):
+    first = exp.generate_output("Hi", "Be brief.")
+    second = exp.generate_output("Hi", "Be brief.")
+    assert first and first == second
+    assert mock_llm.requests == 2
+
+
+def test_analysis_is_cached(mock_llm, monkeypatch):
+    monkeypatch.setattr(exp.response_cache, "enabled", True)
+    first = exp.analyze_prompt("You are a caching test.")
+    assert exp.analyze_prompt("You are a caching test.") == first
+    assert mock_llm.requests == 1
+
+
+def test_identical_calls_are_coalesced(mock_llm, monkeypatch):
+    mock_llm.latency = 0.2
+    monkeypatch.setattr(exp.response_cache, "enabled", True)
+    prompt = f"You are a coalescing test {time.time()}."
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(lambda _: exp.analyze_prompt(prompt), range(4)))
+    assert len({result.model_dump_json() for result in results}) == 1
+    assert mock_llm.requests == 1
+
+
+def analysis(key: str, inputs: list[str], reasoning=None) -> exp.PromptAnalysis:
+    return exp.PromptAnalysis(
+        program_key=key,
+        program_inputs=inputs,
+        hallucination_risk=f"{key} risk",
+        hallucination_targets=[],
+        program_improvement_ideas=[f"{key} idea"],
+        reasoning=reasoning,
+    )
+
+
+def test_merge_analyses():
+    merged = exp.merge_analyses(
+        [
+            analysis("summarize", ["text"], reasoning="first"),
+            analysis("translate", ["text", "language"]),
+            analysis("translate", ["tone"], reasoning="third"),
+        ]
+    )
+    assert merged.program_key == "translate"
+    assert merged.program_inputs == ["text", "language", "tone"]
+    assert merged.hallucination_risk == "summarize risk\ntranslate risk"
+    assert merged.program_improvement_ideas == ["summarize idea", "translate idea"]
+    assert merged.reasoning == "first\nthird"
+
+
+def test_merge_analyses_tie_keeps_the_earliest_key():
+    merged = exp.merge_analyses([analysis("a", []), analysis("b", [])])
+    assert merged.program_key == "a"
+
+
+def test_long_prompt_is_analyzed_in_chunks(mock_llm, monkeypatch):
+    monkeypatch.setattr(exp, "MAX_ANALYSIS_TOKENS", 50)
+    prompt = "\n".join(f"Rule {i}: answer in French." for i in range(40))
+    result = exp.analyze_prompt(prompt, use_cache=False)
+    assert result.program_key
+    assert mock_llm.requests > 1
+
+
+def test_pack_items_respects_budget_and_item_limit():
+    assert exp.pack_items([5, 5, 5, 5], token_budget=10, max_items=10) == [
+        [0, 1],
+        [2, 3],
+    ]
+    assert exp.pack_items([1] * 5, token_budget=100, max_items=2) == [
+        [0, 1],
+        [2, 3],
+        [4],
+    ]
+
+
+def test_pack_items_oversized_item_gets_its_own_batch():
+    assert exp.pack_items([3, 50, 3], token_budget=10, max_items=10) == [
+        [0],
+        [1],
+        [2],
+    ]
+    assert exp.pack_items([], token_budget=10, max_items=10) == []
+
+
+def test_score_outputs_batch_packs_requests(mock_llm):
+    items = [
+        (exp.PromptPair(system_prompt="Be brief.", user_prompt=f"Hi {i}"), "a", "b")
+        for i in range(5)
+    ]
+    scores = exp.score_outputs_batch(items, max_items=2, use_cache=False)
+    assert len(scores) == 5
+    assert all(isinstance(score, exp.OutputScore) for score in scores)
+    # Batches of 2, 2 and 1
+    assert mock_llm.requests == 3
+
+
+@pytest.mark.parametrize("routing", ["static", "fast"])
+def test_slow_fast_model_falls_back(mock_llm, monkeypatch, routing):
+    policy = POLICIES[routing].model_copy(deep=True)
+    for route in policy.ops.values():
+        route.timeout = 0.1
+    monkeypatch.setattr(exp, "routing", policy)
+    mock_llm.model_latency = {FAST_MODEL: 1.0}
+    with collect_round() as usage:
+        exp.analyze_prompt("You are a helpful assistant.", use_cache=False)
+    assert usage.total.fallbacks == 1
+
+
+def test_defective_responses_are_repaired(mock_llm):
+    mock_llm.defect_rate = 1.0
+    prompt_pair = exp.PromptPair(system_prompt="Be brief.", user_prompt="Hi")
+    with collect_round() as usage:
+        score = exp.score_outputs(prompt_pair, "one", "two", use_cache=False)
+    assert 1 <= score.input_1 <= 100
+    total = usage.total
+    assert total.api_calls == 1
+    assert total.invalid_responses == total.repairs == 1
+
+
+def test_refused_response_is_requested_again(monkeypatch):
+    contents = [
+        None,
+        (
+            '{"program_key": "k", "program_inputs": [], '
+            '"hallucination_risk": "", "hallucination_targets": [], '
+            '"program_improvement_ideas": []}'
+        ),
+    ]
+
+    def create(**request):
+        message = SimpleNamespace(content=contents.pop(0))
+        return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=None)
+
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+    monkeypatch.setattr(exp, "get_client", lambda: client)
+    result = exp.analyze_prompt("You are a helpful assistant.", use_cache=False)
+    assert result.program_key == "k"
+    assert contents == []
+
+
+def test_judges_share_criteria(monkeypatch):
+    instructions = []
+
+    def create(**request):
+        instructions.append(request["messages"][0]["content"])
+        raise ValueError("not sent")
+
+    client = SimpleNamespace(
+        chat=SimpleNamespace(completions=SimpleNamespace(create=create))
+    )
+    monkeypatch.setattr(exp, "get_client", lambda: client)
+    prompt_pair = exp.PromptPair(system_prompt="Be brief.", user_prompt="Hi")
+    judges = [
+        lambda: exp.score_outputs(prompt_pair, "a", "b", use_cache=False),
+        lambda: exp.score_outputs_packed(
+            [(prompt_pair, "a", "b")] * 2, use_cache=False
+        ),
+        lambda: exp.rank_outputs(prompt_pair, ["a", "b", "c"], use_cache=False),
+    ]
+    for judge in judges:
+        with pytest.raises(ValueError):
+            judge()
+    assert len(instructions) == 3
+    assert all(exp.JUDGE_CRITERIA in instruction for instruction in instructions)
@@ -0,0 +1,35 @@
+from exp import PromptPair
+from incremental import plan
+from utils import generate_responses
+
+SYSTEM_PROMPT = "You are a helpful assistant. Answer in one short paragraph."
+
+
+def test_first_round_is_full():
+    assert plan(SYSTEM_PROMPT, None) == ("full", 0.0)
+
+
+def test_rounds_reuse_or_diff_the_previous_analysis(mock_llm):
+    first = generate_responses(
+        PromptPair(system_prompt=SYSTEM_PROMPT, user_prompt="Hi")
+    )
+    previous = first.prior_round
+    assert first.incremental.mode == "full"
+    assert plan(SYSTEM_PROMPT, previous) == ("reused", 1.0)
+
+    same = generate_responses(
+        PromptPair(system_prompt=SYSTEM_PROMPT, user_prompt="Hi"), previous=previous
+    )
+    assert same.incremental.mode == "reused"
+    assert same.incremental.tokens_saved > 0
+
+    edited = SYSTEM_PROMPT.replace("short", "brief")
+    assert plan(edited, previous)[0] == "delta"
+    delta = generate_responses(
+        PromptPair(system_prompt=edited, user_prompt="Hi"), previous=previous
+    )
+    assert delta.incremental.mode == "delta"
+    assert delta.incremental.tokens_saved > 0
+
+    rewritten = "Translate everything the user says into French."
+    assert plan(rewritten, previous)[0] == "full"
@@ -0,0 +1,107 @@
+import threading
+import time
+
+import exp
+from exp import PromptPair
+from jobs import JobQueue, JobStatus
+from scheduler import Scheduler
+
+PROMPT_PAIR = PromptPair(system_prompt="Be brief.", user_prompt="Hi")
+
+
+def wait_for(queue: JobQueue, job_id: str, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = queue.get(job_id)
+        if job.finished:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def test_round_runs_against_the_mock(mock_llm):
+    queue = JobQueue(workers=2)
+    job_id = queue.submit(PROMPT_PAIR)
+    job = wait_for(queue, job_id)
+    assert job.status == JobStatus.DONE, job.error
+    assert job.result.original_output
+    assert job.partial["original"] == job.result.original_output
+
+
+def test_handler_errors_fail_the_job():
+    def fail(prompt_pair, on_token, **kwargs):
+        raise RuntimeError("boom")
+
+    queue = JobQueue(workers=1, handler=fail)
+    job = wait_for(queue, queue.submit(PROMPT_PAIR))
+    assert job.status == JobStatus.FAILED
+    assert job.error == "boom"
+
+
+def test_kwargs_reach_the_handler():
+    seen = {}
+
+    def handler(prompt_pair, on_token, **kwargs):
+        seen.update(kwargs)
+
+    queue = JobQueue(workers=1, handler=handler)
+    wait_for(queue, queue.submit(PROMPT_PAIR, judge=False))
+    assert seen == {"judge": False}
+
+
+def test_late_tokens_stay_out_of_the_next_job():
+    callbacks = []
+    late_token_sent = threading.Event()
+
+    def handler(prompt_pair, on_token, **kwargs):
+        callbacks.append(on_token)
+        on_token("original", prompt_pair.user_prompt)
+        if len(callbacks) == 2:
+            # The first job's stream, abandoned at its deadline, keeps going
+            callbacks[0]("original", " late")
+            late_token_sent.set()
+
+    queue = JobQueue(workers=1, handler=handler)
+    first = wait_for(queue, queue.submit(PROMPT_PAIR))
+    second_id = queue.submit(PromptPair(user_prompt="second"))
+    assert late_token_sent.wait(5)
+    second = wait_for(queue, second_id)
+    assert first.partial["original"] == "Hi"
+    assert queue.get(first.id).partial["original"] == "Hi"
+    assert second.partial["original"] == "second"
+
+
+def test_finished_jobs_expire():
+    queue = JobQueue(workers=1, handler=lambda *args, **kwargs: None, retention=0)
+    job_id = queue.submit(PROMPT_PAIR)
+    wait_for(queue, job_id)
+    queue.submit(PROMPT_PAIR)
+    assert queue.get(job_id) is None
+
+
+def test_streams_count_toward_max_in_flight(mock_llm, monkeypatch):
+    # Streams long enough to overlap if both were admitted at once
+    mock_llm.token_delay = 0.005
+    monkeypatch.setattr(
+        exp,
+        "scheduler",
+        Scheduler(requests_per_minute=1e9, tokens_per_minute=1e12, max_in_flight=1),
+    )
+    spans = {}
+
+    def stream(name: str):
+        times = []
+        exp.stream_output(
+            "Hi", "Be brief.", on_token=lambda token: times.append(time.perf_counter())
+        )
+        spans[name] = (times[0], times[-1])
+
+    threads = [threading.Thread(target=stream, args=(name,)) for name in "ab"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    first, second = sorted(spans.values())
+    # The second stream only starts once the first has been read
+    assert second[0] > first[1]
@@ -0,0 +1,60 @@
+import json
+import subprocess
+import sys
+
+import openai
+import pytest
+
+import exp
+from mock_server import MockLLMServer
+
+
+def test_json_responses_parse(mock_llm):
+    result = exp.analyze_prompt("You are a helpful assistant.", use_cache=False)
+    assert isinstance(result, exp.PromptAnalysis)
+    assert result.program_key
+    assert mock_llm.requests == 1
+
+
+def test_text_and_streamed_outputs_match(mock_llm):
+    tokens = []
+    streamed = exp.stream_output("Hi", "Be brief.", on_token=tokens.append)
+    assert streamed.output.strip() == exp.generate_output("Hi", "Be brief.")
+    assert "".join(tokens) == streamed.output
+
+
+def test_injected_rate_limits():
+    with MockLLMServer(latency=0, error_rate=1.0) as server:
+        client = openai.OpenAI(base_url=server.base_url, api_key="mock", max_retries=0)
+        with pytest.raises(openai.RateLimitError):
+            client.chat.completions.create(
+                model="gpt-4o", messages=[{"role": "user", "content": "Hi"}]
+            )
+
+
+def test_bench_smoke(tmp_path):
+    """The benchmark runs end to end against its own mock server."""
+    output = tmp_path / "bench.json"
+    subprocess.run(
+        [
+            sys.executable,
+            "bench.py",
+            "--rounds",
+            "2",
+            "--concurrency",
+            "2",
+            "--latency",
+            "0",
+            "--jitter",
+            "0",
+            "--json",
+            str(output),
+        ],
+        check=True,
+        capture_output=True,
+        timeout=120,
+    )
+    (result,) = json.loads(output.read_text())
+    assert result["name"] == "generate_responses"
+    assert result["rounds"] == 2 and result["errors"] == 0
+    assert result["tokens_per_round"] > 0
@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from pipeline import Stage, run_pipeline
+
+
+def test_stages_get_their_dependencies_results():
+    results, timings = run_pipeline(
+        [
+            Stage("a", lambda: 1),
+            Stage("b", lambda a: a + 1, deps=("a",)),
+            Stage("c", lambda a, b: a + b, deps=("a", "b")),
+        ]
+    )
+    assert results == {"a": 1, "b": 2, "c": 3}
+    assert timings.critical_path == ["a", "b", "c"]
+    assert timings.timed_out == [] and timings.skipped == []
+
+
+def test_unknown_dependency():
+    with pytest.raises(ValueError):
+        run_pipeline([Stage("a", lambda missing: None, deps=("missing",))])
+
+
+def test_stage_error_is_raised():
+    def fail():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        run_pipeline([Stage("a", fail), Stage("b", lambda: 1)])
+
+
+def test_deadline_abandons_slow_stages_and_skips_dependents():
+    started = time.perf_counter()
+    results, timings = run_pipeline(
+        [
+            Stage("fast", lambda: "done"),
+            Stage("slow", lambda: time.sleep(2)),
+            Stage("after_slow", lambda slow: None, deps=("slow",)),
+        ],
+        deadline=0.2,
+    )
+    # Returns at the deadline without waiting for the slow stage
+    assert time.perf_counter() - started < 1
+    assert results == {"fast": "done"}
+    assert timings.timed_out == ["slow"]
+    assert timings.skipped == ["after_slow"]
+
+
+def test_stage_timeout():
+    results, timings = run_pipeline(
+        [
+            Stage("slow", lambda: time.sleep(2), timeout=0.1),
+            Stage("other", lambda: time.sleep(0.3) or "done"),
+        ]
+    )
+    assert results == {"other": "done"}
+    assert timings.timed_out == ["slow"]
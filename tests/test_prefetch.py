@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from exp import PromptPair
+from prefetch import Prefetcher
+from utils import generate_responses
+
+
+@pytest.fixture
+def prefetcher():
+    prefetcher = Prefetcher()
+    yield prefetcher
+    prefetcher.shutdown()
+
+
+def wait_until_running(prefetcher: Prefetcher, prompt: str):
+    deadline = time.monotonic() + 5
+    while not prefetcher._futures[prompt][0].running():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_hit(mock_llm, prefetcher):
+    prefetcher.prefetch(["You are a helpful assistant."])
+    result = prefetcher.get("You are a helpful assistant.")
+    assert result is not None
+    assert result.analysis.program_key
+    assert (prefetcher.hits, prefetcher.misses) == (1, 0)
+
+
+def test_miss_for_a_prompt_never_prefetched(mock_llm, prefetcher):
+    assert prefetcher.get("You are a pirate.") is None
+    assert prefetcher.misses == 1
+
+
+def test_queued_prefetch_is_cancelled_instead_of_waited_on(mock_llm, prefetcher):
+    mock_llm.latency = 0.5
+    prefetcher.prefetch(["You are A.", "You are B."])
+    wait_until_running(prefetcher, "You are A.")
+
+    started = time.perf_counter()
+    # B is queued behind A on the single worker
+    assert prefetcher.get("You are B.") is None
+    assert time.perf_counter() - started < 0.1
+    assert "You are B." not in prefetcher._futures
+
+    # A already started, so it is worth waiting for
+    assert prefetcher.get("You are A.") is not None
+    assert (prefetcher.hits, prefetcher.misses) == (1, 1)
+
+
+def test_dropped_prompts_are_cancelled(mock_llm, prefetcher):
+    prefetcher.prefetch(["You are A.", "You are B."])
+    prefetcher.prefetch(["You are A."])
+    assert list(prefetcher._futures) == ["You are A."]
+
+
+def test_edited_prompt_is_prefetched_as_a_delta(mock_llm, prefetcher):
+    system_prompt = "You are a helpful assistant. Answer in one short paragraph."
+    first = generate_responses(
+        PromptPair(system_prompt=system_prompt, user_prompt="Hi")
+    )
+    previous = first.prior_round
+
+    edited = system_prompt.replace("short", "brief")
+    # The unchanged prompt is reused by the round, so it isn't prefetched
+    prefetcher.prefetch([system_prompt, edited], previous=previous)
+    assert list(prefetcher._futures) == [edited]
+    prefetcher._futures[edited][0].result()
+
+    requests = mock_llm.requests
+    data = generate_responses(
+        PromptPair(system_prompt=edited, user_prompt="Hi"),
+        prefetcher=prefetcher,
+        previous=previous,
+    )
+    assert data.prefetched
+    assert data.incremental.mode == "delta"
+    assert data.incremental.tokens_saved > 0
+    # Only the two outputs and the judge are left for the round itself
+    assert mock_llm.requests - requests == 3
+
+
+def test_prefetch_for_another_round_is_a_miss(mock_llm, prefetcher):
+    prefetcher.prefetch(["You are A."])
+    prefetcher._futures["You are A."][0].result()
+    other = generate_responses(PromptPair(system_prompt="You are B.", user_prompt="Hi"))
+    assert prefetcher.get("You are A.", previous=other.prior_round) is None
@@ -0,0 +1,27 @@
+import exp
+from routing import FAST_MODEL, FAST_TIMEOUT, MODEL, POLICIES, ModelRoute
+
+
+def test_single_policy_uses_the_strong_model():
+    route = POLICIES["single"].route("analyze_prompt")
+    assert route.attempts(prompt_tokens=100) == [(MODEL, None)]
+
+
+def test_static_policy_routes_analysis_to_the_fast_model():
+    policy = POLICIES["static"]
+    assert policy.route("analyze_prompt").attempts(100) == [
+        (FAST_MODEL, FAST_TIMEOUT),
+        (MODEL, None),
+    ]
+    assert policy.route("generate_output").model == MODEL
+    assert policy.route(None).model == MODEL
+
+
+def test_long_prompts_skip_to_the_fallback():
+    route = ModelRoute(model=FAST_MODEL, fallback=MODEL, max_prompt_tokens=10)
+    assert route.attempts(prompt_tokens=5)[0][0] == FAST_MODEL
+    assert route.attempts(prompt_tokens=50) == [(MODEL, None)]
+
+
+def test_exp_model_is_the_default_route():
+    assert exp.MODEL == exp.routing.default.model == MODEL
@@ -0,0 +1,128 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import openai
+import pytest
+
+from scheduler import Scheduler, TokenBucket, retry_after
+
+
+def unlimited(**kwargs) -> Scheduler:
+    return Scheduler(
+        requests_per_minute=1e9, tokens_per_minute=1e12, base_delay=0, **kwargs
+    )
+
+
+def rate_limit_error(headers: dict) -> openai.RateLimitError:
+    request = httpx.Request("POST", "http://mock/v1/chat/completions")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def test_token_bucket_reservations_queue_in_order():
+    bucket = TokenBucket(rate_per_minute=60)
+    assert bucket.reserve(60) == 0
+    # One token a second
+    assert bucket.reserve(1) == pytest.approx(1, abs=0.05)
+    assert bucket.reserve(1) == pytest.approx(2, abs=0.05)
+    assert not bucket.try_take(1)
+
+
+def test_retry_after_headers():
+    assert retry_after(rate_limit_error({"retry-after-ms": "250"})) == 0.25
+    assert retry_after(rate_limit_error({"retry-after": "2"})) == 2
+    assert retry_after(rate_limit_error({})) is None
+
+
+def test_retries_retryable_errors():
+    errors = [rate_limit_error({"retry-after-ms": "1"})] * 2
+
+    def flaky():
+        if errors:
+            raise errors.pop()
+        return "ok"
+
+    result, timing = unlimited().run(flaky, estimated_tokens=10)
+    assert result == "ok"
+    assert timing.attempts == 3
+    assert timing.rate_limited == 2
+
+
+def test_no_retry_errors_are_raised_at_once():
+    calls = []
+
+    def fail():
+        calls.append(1)
+        raise rate_limit_error({})
+
+    with pytest.raises(openai.RateLimitError):
+        unlimited().run(fail, estimated_tokens=10, no_retry=(openai.RateLimitError,))
+    assert len(calls) == 1
+
+
+def test_max_in_flight():
+    scheduler = unlimited(max_in_flight=2)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            running.append(1)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    with ThreadPoolExecutor(8) as executor:
+        list(executor.map(lambda _: scheduler.run(call, 10), range(8)))
+    assert max(peak) == 2
+
+
+def test_slow_call_is_hedged_when_idle():
+    scheduler = unlimited()
+    calls = []
+
+    def call():
+        calls.append(1)
+        # Only the first request is slow
+        time.sleep(1 if len(calls) == 1 else 0)
+        return len(calls)
+
+    started = time.perf_counter()
+    result, timing = scheduler.run(call, 10, hedge_after=0.05)
+    assert time.perf_counter() - started < 0.5
+    assert result == 2
+    assert timing.hedged
+    assert scheduler.stats().hedges == 1
+
+
+def test_queueing_time_does_not_count_toward_the_hedge_delay():
+    scheduler = unlimited(max_in_flight=4)
+
+    def call():
+        time.sleep(0.05)
+
+    with ThreadPoolExecutor(32) as executor:
+        timings = list(
+            executor.map(
+                lambda _: scheduler.run(call, 10, hedge_after=0.1)[1], range(32)
+            )
+        )
+    assert sum(timing.queued for timing in timings) > 0
+    assert not any(timing.hedged for timing in timings)
+    assert scheduler.stats().hedges == 0
+
+
+def test_held_slot_is_kept_until_released():
+    scheduler = unlimited(max_in_flight=1)
+    scheduler.run(lambda: "stream", 10, hold_slot=True)
+    second = threading.Thread(target=scheduler.run, args=(lambda: None, 10))
+    second.start()
+    second.join(0.2)
+    assert second.is_alive()
+    scheduler.release()
+    second.join(5)
+    assert not second.is_alive()
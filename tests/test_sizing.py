@@ -0,0 +1,25 @@
+from sizing import count_tokens, split_text, truncate
+
+
+def test_split_text_keeps_lines_whole():
+    text = "".join(f"line {i}\n" for i in range(100))
+    chunks = split_text(text, max_tokens=20)
+    assert "".join(chunks) == text
+    assert all(count_tokens(chunk) <= 20 for chunk in chunks)
+    assert all(chunk.endswith("\n") for chunk in chunks)
+
+
+def test_split_text_cuts_a_huge_line():
+    text = "x" * 1000
+    chunks = split_text(text, max_tokens=10)
+    assert "".join(chunks) == text
+    assert len(chunks) > 1
+
+
+def test_truncate_keeps_start_and_end():
+    text = "start " + "middle " * 1000 + "end"
+    cut = truncate(text, max_tokens=50)
+    assert cut.startswith("start") and cut.endswith("end")
+    assert "tokens omitted" in cut
+    assert count_tokens(cut) < count_tokens(text)
+    assert truncate("short", max_tokens=50) == "short"
@@ -0,0 +1,84 @@
+import json
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+
+import structured
+from exp import BatchScores, OutputScore, PromptAnalysis
+
+
+def test_response_format():
+    response_format = structured.response_format(OutputScore)
+    assert response_format["type"] == "json_schema"
+    assert response_format["json_schema"]["name"] == "OutputScore"
+    assert "input_1" in response_format["json_schema"]["schema"]["properties"]
+
+
+def test_repair_strips_fences_and_surrounding_text():
+    content = 'Here you go:\n```json\n{"input_1": 70, "input_2": 80, "comparison_notes": [], "winner": "input_2"}\n```'
+    fixed = structured.repair(OutputScore, content)
+    assert OutputScore.model_validate_json(fixed).input_2 == 80
+
+
+def test_repair_coerces_fields():
+    content = json.dumps(
+        {
+            "input_1": "85/100",
+            "input_2": 250,
+            "comparison_notes": "- clearer\n- shorter",
+            "winner": ["input_1"],
+        }
+    )
+    score = OutputScore.model_validate_json(structured.repair(OutputScore, content))
+    assert score.input_1 == 85
+    # Clamped to the field's le=100
+    assert score.input_2 == 100
+    assert score.comparison_notes == ["clearer", "shorter"]
+    assert score.winner == "input_1"
+
+
+def test_repair_fills_missing_lists():
+    content = json.dumps(
+        {
+            "program_key": "summarize",
+            "program_inputs": None,
+            "hallucination_risk": "low",
+        }
+    )
+    analysis = PromptAnalysis.model_validate_json(
+        structured.repair(PromptAnalysis, content)
+    )
+    assert analysis.program_inputs == []
+    assert analysis.hallucination_targets == []
+    assert analysis.program_improvement_ideas == []
+
+
+def test_repair_nested_models():
+    content = json.dumps(
+        {"scores": [{"item": "1", "input_1": 0, "input_2": 50, "winner": "input_2"}]}
+    )
+    scores = BatchScores.model_validate_json(structured.repair(BatchScores, content))
+    assert scores.scores[0].item == 1
+    assert scores.scores[0].input_1 == 1
+    assert scores.scores[0].comparison_notes == []
+
+
+def test_repair_optional_fields():
+    class Model(BaseModel):
+        values: Optional[list[int]] = None
+        other: Optional[int] = None
+
+    fixed = json.loads(structured.repair(Model, '{"values": "1", "other": "2"}'))
+    assert fixed == {"values": [1], "other": 2}
+
+
+@pytest.mark.parametrize("content", ["no json here", "[1, 2]"])
+def test_repair_rejects_content_without_an_object(content):
+    with pytest.raises(ValueError):
+        structured.repair(OutputScore, content)
+
+
+def test_repair_rejects_missing_content():
+    with pytest.raises(TypeError):
+        structured.repair(OutputScore, None)
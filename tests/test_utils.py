@@ -0,0 +1,54 @@
+import time
+
+import pytest
+
+from exp import PromptPair
+from utils import generate_responses
+
+PROMPT_PAIR = PromptPair(system_prompt="Be brief.", user_prompt="Hi")
+
+
+def test_round(mock_llm):
+    data = generate_responses(PROMPT_PAIR)
+    assert data.original_output and data.optimized_output
+    assert data.original_score is not None and data.optimized_score is not None
+    assert not data.partial
+
+
+def test_round_without_judge(mock_llm):
+    data = generate_responses(PROMPT_PAIR, judge=False)
+    assert data.original_score is None
+
+
+def test_slow_judge_gives_a_partial_round(mock_llm):
+    # Only the judge's request is slow
+    respond = mock_llm.respond
+
+    def slow_judge(request):
+        if "evaluator" in request["messages"][0]["content"]:
+            time.sleep(1)
+        return respond(request)
+
+    mock_llm.respond = slow_judge
+    data = generate_responses(PROMPT_PAIR, stage_timeouts={"score": 0.2})
+    assert data.partial
+    assert data.original_score is None
+    assert data.original_output and data.optimized_output
+
+
+def test_round_past_its_deadline_fails(mock_llm):
+    mock_llm.latency = 1
+    with pytest.raises(TimeoutError):
+        generate_responses(PROMPT_PAIR, deadline=0.2)
+
+
+def test_fused_round(mock_llm):
+    data = generate_responses(PROMPT_PAIR, fused=True)
+    assert "analyze_and_optimize" in data.usage.by_op
+    assert "optimize_prompt" not in data.usage.by_op
+
+
+def test_fused_is_skipped_with_several_candidates(mock_llm):
+    data = generate_responses(PROMPT_PAIR, fused=True, candidates=2)
+    assert "analyze_and_optimize" not in data.usage.by_op
+    assert data.tournament is not None
@@ -0,0 +1,54 @@
+"""Lazy weave initialization.
+
+PROMPTER_TRACING selects the mode:
+- "background" (default): weave.init runs on a daemon thread so startup never
+  waits on the network handshake. Ops that finish before it is ready are not
+  traced.
+- "blocking": weave.init runs inline, as before.
+- "off": never initialize weave. Ops still run, their traces are dropped.
+"""
+
+import os
+import sys
+import threading
+from typing import Optional
+
+import weave
+
+_lock = threading.Lock()
+_ready = threading.Event()
+_started = False
+
+
+def tracing_mode() -> str:
+    return os.environ.get("PROMPTER_TRACING", "background").lower()
+
+
+def _init(project: str):
+    try:
+        weave.init(project)
+        _ready.set()
+    except Exception as e:
+        # No network or no credentials: keep running untraced
+        print(f"weave tracing disabled: {e}", file=sys.stderr)
+
+
+def init_tracing(project: str, mode: Optional[str] = None):
+    """Start weave tracing for `project` once per process."""
+    global _started
+    mode = mode or tracing_mode()
+    with _lock:
+        if _started or mode == "off":
+            return
+        _started = True
+    if mode == "blocking":
+        _init(project)
+    else:
+        threading.Thread(
+            target=_init, args=(project,), name="weave-init", daemon=True
+        ).start()
+
+
+def tracing_ready(timeout: Optional[float] = 0) -> bool:
+    """Whether weave finished initializing, optionally waiting up to `timeout`."""
+    return _ready.wait(timeout)
@@ -1,18 +1,30 @@
 from enum import Enum
-from pydantic import BaseModel
+from typing import Callable, Optional
+
 import weave
-from typing import Optional
+from pydantic import BaseModel, Field
+
+import exp
+from candidates import TournamentResult, optimize_candidates
 from exp import (
     OptimizedPrompt,
     OutputScore,
-    PromptComparison,
+    PromptAnalysis,
+    PromptPair,
+    analyze_and_optimize,
     analyze_prompt,
+    analyze_prompt_delta,
+    generate_output,
     optimize_prompt,
-    compare_outputs,
     score_outputs,
-    PromptAnalysis,
-    PromptPair,
+    stream_output,
 )
+from incremental import IncrementalSavings, PriorRound, next_round, plan, savings
+from metrics import RoundUsage, collect_round
+from pipeline import PipelineTimings, Stage, run_pipeline
+from prefetch import Prefetcher
+from scheduler import track_calls
+from sizing import count_tokens
 
 
 class AnalysisData(BaseModel):
@@ -24,12 +36,40 @@ class AnalysisData(BaseModel):
     hallucination_risk: str
     hallucination_targets: list[str]
     program_improvement_ideas: list[str]
-    comparison_notes: list[str]
-    winner: str
-    original_score: int
-    optimized_score: int
+    # The judge's verdict; unset for rounds run with judge=False
+    comparison_notes: list[str] = []
+    winner: Optional[str] = None
+    original_score: Optional[int] = None
+    optimized_score: Optional[int] = None
     original_output: str
     optimized_output: str
+    timings: Optional[PipelineTimings] = None
+    # Only set when the outputs were streamed, keyed "original"/"optimized"
+    time_to_first_token: dict[str, float] = {}
+    # weave call id of the generate_responses call that produced this round
+    call_id: Optional[str] = None
+    # Whether analysis and optimization came from a speculative prefetch
+    prefetched: bool = False
+    incremental: Optional[IncrementalSavings] = None
+    # Tokens, time, retries and cache hits of this round, per op
+    usage: Optional[RoundUsage] = None
+    # Set when the optimized prompt was picked from several candidates
+    tournament: Optional[TournamentResult] = None
+    # The judge missed the round deadline, so the scores are unset
+    partial: bool = False
+    # Pass back to generate_responses as `previous` for the next round
+    prior_round: Optional[PriorRound] = Field(default=None, exclude=True)
+
+    def with_scores(self, scores: OutputScore) -> "AnalysisData":
+        """A copy with the judge's verdict filled in."""
+        return self.model_copy(
+            update={
+                "comparison_notes": scores.comparison_notes,
+                "winner": scores.winner,
+                "original_score": scores.input_1,
+                "optimized_score": scores.input_2,
+            }
+        )
 
     def to_dict(self) -> dict:
         """Convert the AnalysisData model to a dictionary."""
@@ -37,34 +77,187 @@ class AnalysisData(BaseModel):
 
 
 @weave.op
-def generate_responses(prompt_pair: PromptPair) -> AnalysisData:
+def generate_responses(
+    prompt_pair: PromptPair,
+    on_token: Optional[Callable[[str, str], None]] = None,
+    prefetcher: Optional[Prefetcher] = None,
+    previous: Optional[PriorRound] = None,
+    candidates: int = 1,
+    candidate_concurrency: int = 4,
+    fused: bool = False,
+    judge: bool = True,
+    deadline: Optional[float] = None,
+    stage_timeouts: Optional[dict[str, float]] = None,
+) -> AnalysisData:
     """Generate original and optimized responses for a given prompt pair.
 
+    The stages run as a dependency graph, so the original output is generated
+    while the prompt is still being analyzed and optimized.
+
     Args:
         prompt_pair: The user's input prompt pair containing system and user prompts
+        on_token: If given, both outputs are streamed and this is called with
+            ("original" | "optimized", token) as tokens arrive
+        prefetcher: Checked first for an already computed analysis and
+            optimization of the prompt
+        previous: The prior round's AnalysisData.prior_round. An unchanged
+            prompt reuses its analysis and optimization, a small edit gets a
+            delta analysis instead of a full one
+        candidates: Number of optimized prompts to generate and judge against
+            each other; the winner is used as the optimized prompt
+        candidate_concurrency: Most candidates generated at once
+        fused: Analyze and optimize in one call instead of two. Ignored with
+            more than one candidate
+        judge: Score the outputs. Without it the scores are left unset, e.g.
+            to score many rounds at once with score_outputs_batch
+        deadline: Seconds the whole round may take. If only the judge is
+            unfinished by then, a partial round without scores is returned
+        stage_timeouts: Seconds each named stage may take once started
 
     Returns:
-        Dictionary containing (original_response, optimized_response, analysis_data)
+        AnalysisData with both outputs, the analysis, scores and stage timings
     """
     # Only analyze and optimize the system prompt if it exists
-    optimized_system_prompt = None
     if prompt_pair.system_prompt:
         prompt = prompt_pair.system_prompt
     else:
         prompt = prompt_pair.user_prompt
 
-    # Analyze the system prompt
-    analysis: PromptAnalysis = analyze_prompt(prompt, is_system_prompt=True)
+    call = weave.get_current_call()
+    time_to_first_token = {}
 
-    # Optimize the system prompt
-    optimized: OptimizedPrompt = optimize_prompt(analysis, prompt)
-    optimized_system_prompt = optimized.optimized_prompt
+    def output(side: str, system_prompt: Optional[str]) -> str:
+        if side == "optimized" and tournament:
+            winner_output = tournament[0].winner.output
+            if on_token is not None:
+                on_token(side, winner_output)
+            return winner_output
+        if on_token is None:
+            return generate_output(prompt_pair.user_prompt, system_prompt)
+        streamed = stream_output(
+            prompt_pair.user_prompt,
+            system_prompt,
+            lambda token: on_token(side, token),
+        )
+        if streamed.time_to_first_token is not None:
+            time_to_first_token[side] = streamed.time_to_first_token
+        return streamed.output
 
-    # Get responses for both prompts
-    comparison: PromptComparison = compare_outputs(prompt_pair, optimized_system_prompt)
-    scores: OutputScore = score_outputs(
-        prompt_pair, comparison.original_output, comparison.optimized_output
-    )
+    prefetched = []
+    fused_result = []
+    mode, ratio = plan(prompt, previous)
+    tokens_spent = {"analyze": 0, "optimize": 0}
+
+    def analyze() -> PromptAnalysis:
+        # Waits on a prefetch already running for this prompt rather than
+        # repeating it; the original output is generated meanwhile
+        hit = prefetcher.get(prompt, previous) if prefetcher else None
+        if hit:
+            prefetched.append(hit)
+            return hit.analysis
+        if mode == "reused":
+            return previous.analysis
+        with track_calls() as calls:
+            if mode == "delta":
+                analysis = analyze_prompt_delta(
+                    previous.analysis, previous.prompt, prompt
+                )
+            elif (
+                fused
+                and candidates == 1
+                and count_tokens(prompt) <= exp.MAX_ANALYSIS_TOKENS
+            ):
+                # Oversized prompts need the chunked analysis instead, and
+                # candidates are optimized separately
+                fused_result.append(analyze_and_optimize(prompt))
+                analysis = fused_result[0].analysis
+            else:
+                analysis = analyze_prompt(prompt, is_system_prompt=True)
+        tokens_spent["analyze"] = sum(
+            c.actual_tokens or c.estimated_tokens for c in calls
+        )
+        return analysis
+
+    tournament = []
+
+    def optimize(analyze: PromptAnalysis) -> OptimizedPrompt:
+        if prefetched:
+            return prefetched[0].optimized
+        if mode == "reused":
+            return previous.optimized
+        if fused_result:
+            return fused_result[0].optimized
+        with track_calls() as calls:
+            if candidates > 1:
+                # The winner's output is generated as part of the tournament
+                tournament.append(
+                    optimize_candidates(
+                        prompt_pair,
+                        analyze,
+                        prompt,
+                        n=candidates,
+                        max_concurrency=candidate_concurrency,
+                    )
+                )
+                optimized = tournament[0].winner.optimized
+            else:
+                optimized = optimize_prompt(analyze, prompt)
+        tokens_spent["optimize"] = sum(
+            c.actual_tokens or c.estimated_tokens for c in calls
+        )
+        return optimized
+
+    stage_timeouts = stage_timeouts or {}
+    stages = [
+        Stage("analyze", analyze, timeout=stage_timeouts.get("analyze")),
+        Stage(
+            "optimize",
+            optimize,
+            deps=("analyze",),
+            timeout=stage_timeouts.get("optimize"),
+        ),
+        Stage(
+            "original_output",
+            lambda: output("original", prompt_pair.system_prompt),
+            timeout=stage_timeouts.get("original_output"),
+        ),
+        Stage(
+            "optimized_output",
+            lambda optimize: output("optimized", optimize.optimized_prompt),
+            deps=("optimize",),
+            timeout=stage_timeouts.get("optimized_output"),
+        ),
+    ]
+    if judge:
+        stages.append(
+            Stage(
+                "score",
+                lambda original_output, optimized_output: score_outputs(
+                    prompt_pair, original_output, optimized_output
+                ),
+                deps=("original_output", "optimized_output"),
+                timeout=stage_timeouts.get("score"),
+            )
+        )
+    with collect_round() as usage:
+        results, timings = run_pipeline(stages, deadline=deadline)
+
+    unfinished = [stage.name for stage in stages if stage.name not in results]
+    if unfinished and unfinished != ["score"]:
+        # Without both outputs there is nothing to compare
+        raise TimeoutError(f"Round deadline passed before {unfinished} finished")
+
+    analysis: PromptAnalysis = results["analyze"]
+    optimized: OptimizedPrompt = results["optimize"]
+    scores: Optional[OutputScore] = results.get("score")
+    analyze_cost = (timings.stages["analyze"].duration, tokens_spent["analyze"])
+    optimize_cost = (timings.stages["optimize"].duration, tokens_spent["optimize"])
+    if prefetched:
+        # The prefetch planned and paid for the analysis ahead of the round
+        hit = prefetched[0]
+        mode = hit.mode
+        analyze_cost = (hit.analyze_seconds, hit.analyze_tokens)
+        optimize_cost = (hit.optimize_seconds, hit.optimize_tokens)
 
     analysis_data = AnalysisData(
         program_key=analysis.program_key,
@@ -72,17 +265,28 @@ def generate_responses(prompt_pair: PromptPair) -> AnalysisData:
         hallucination_risk=analysis.hallucination_risk,
         hallucination_targets=analysis.hallucination_targets,
         program_improvement_ideas=analysis.program_improvement_ideas,
-        comparison_notes=scores.comparison_notes,
-        winner=scores.winner,
-        original_score=scores.input_1,
-        optimized_score=scores.input_2,
         original_system_prompt=prompt_pair.system_prompt,
-        optimized_system_prompt=optimized_system_prompt,
+        optimized_system_prompt=optimized.optimized_prompt,
         user_prompt=prompt_pair.user_prompt,
-        original_output=comparison.original_output,
-        optimized_output=comparison.optimized_output,
+        original_output=results["original_output"],
+        optimized_output=results["optimized_output"],
+        timings=timings,
+        time_to_first_token=time_to_first_token,
+        call_id=call.id if call else None,
+        prefetched=bool(prefetched),
+        incremental=savings(mode, ratio, previous, analyze_cost),
+        usage=usage,
+        tournament=tournament[0] if tournament else None,
+        prior_round=next_round(
+            prompt, analysis, optimized, mode, previous, analyze_cost, optimize_cost
+        ),
     )
 
+    if scores is not None:
+        analysis_data = analysis_data.with_scores(scores)
+    elif judge:
+        analysis_data.partial = True
+
     return analysis_data
 
 